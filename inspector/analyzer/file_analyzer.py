@@ -11,8 +11,7 @@ class FileAnalyzer(object):
             :type file_obj: inspector.models.base.File
         """
         textchars = ''.join(map(chr, [7, 8, 9, 10, 12, 13, 27] + range(0x20, 0x100)))
-        with open(file_obj.get_abs_path(), 'r') as f:
-            sample_bytes = f.read(1024)
+        sample_bytes = file_obj.read_head(1024)
         return bool(sample_bytes.translate(None, textchars))
 
     @classmethod
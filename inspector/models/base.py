@@ -1,19 +1,69 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import copy
+import mmap
+import time
 import logging
-
-from inspector.models.consts import Language
+import weakref
+import threading
+import multiprocessing
+from collections import namedtuple
+
+from inspector.models.consts import Language, ParseMode
+from inspector.models.exceptions import ContentChangedError, ParseFailure
+from inspector.models.snapshot import ProjectSnapshot
+from inspector.models.symbols import SymbolIndex
+from inspector.models.tables import ModelTables
 from inspector.parser.file_tokenizer import FileTokenizer
 from inspector.utils.arrays import find
-from inspector.utils.files import get_extension
+from inspector.utils.files import get_extension, same_stat, walk_tree, WalkEvent, GitIgnore
 from inspector.utils.lang import enum
+from inspector.utils.lines import LineIndex, LinesView
 from inspector.utils.strings import summarize, has_word
 
 
 logging.basicConfig(filename='logs.log', filemode='w', level=logging.DEBUG)
 logger = logging.getLogger('models_base')
 
+_worker_project = None  # the project files are loaded from, in parse_all worker processes
+# each file is parsed by one thread at a time (e.g. by the queries of saqld clients), other files are parsed meanwhile
+_parse_locks = weakref.WeakKeyDictionary()  # SourceFile -> its lock
+_parse_locks_lock = threading.Lock()
+_parsed_callback_lock = threading.RLock()  # the callbacks update shared models, e.g. the symbols of the project
+
+
+def _get_parse_lock(source_file):
+    with _parse_locks_lock:
+        lock = _parse_locks.get(source_file)
+        if lock is None:
+            lock = _parse_locks[source_file] = threading.RLock()
+        return lock
+
+
+def _init_parse_worker(project):
+    global _worker_project
+    _worker_project = project
+
+
+def _parse_file_worker(rel_path):
+    """ Load a file of the worker project, returning a (path, file, failure) tuple
+    """
+    try:
+        f = _worker_project.load_file(rel_path)
+        if isinstance(f, SourceFile):
+            f.ensure_parsed()
+        return rel_path, f, None
+    except Exception as e:
+        return rel_path, None, ParseFailure(rel_path, type(e).__name__, unicode(e))
+
+
+# changes of project files found by a rescan, lists of relative paths
+FilesDiff = namedtuple('FilesDiff', ['added', 'changed', 'removed'])
+
+# counts of the project files (all, loaded and parsed ones), and total parse time of the parsed files in seconds
+ParseStatistics = namedtuple('ParseStatistics', ['files', 'loaded', 'parsed', 'parse_time'])
+
 
 class LocatableInterface(object):
     @property
@@ -30,16 +80,28 @@ class Project(LocatableInterface):
         self._path = ''
         self.name = ''
         self.source_roots = []
-        self.ignored_dirs = []  # TODO: load this from .gitignore file
+        self.ignored_dirs = []  # directory path prefixes that are not scanned
+        self.gitignore = None  # patterns of the project .gitignore file (and the .git directory)
 
         # files
         self._files = {}  # loaded files cache
+        self._files_stat = {}  # (mtime, size) of files in the last rescan, to detect changes
+        self.generation = 0  # incremented whenever the project files change, e.g. for invalidating query indexes
         self.file_extensions = set()
+        self.mmap_threshold = 4 * 1024 * 1024  # files of at least this size (in bytes) are memory-mapped
+        self.parse_cache = None  # a inspector.models.cache.ParseCache, to reuse parsed files of previous runs
+        self.snapshot = None  # a ProjectSnapshot, parsed files are read from it instead of being parsed, if not changed
+        self.symbols = SymbolIndex()  # symbols of the loaded files
+        self.parse_mode = ParseMode.FULL  # parse mode of the loaded source files
+        self._qualified_paths = {}  # java dotted names in source roots -> relative paths of the files
+        self._qualified_roots = []  # the source roots _qualified_paths is built for
+        self._declared_paths = {}  # dotted names by the package declared in loaded files -> relative paths
 
         # initial configuration
         self.abs_path = path
         self.name = name if name is not None else re.split(r'[/\\]', self.abs_path)[-2]
         self.auto_detect_roots()
+        self.load_gitignore()
 
     #########################
     #  File System Related  #
@@ -103,41 +165,85 @@ class Project(LocatableInterface):
             pass
 
     def rescan_files(self, handler=None):
-        """
+        """ Update the project files from the file system, keeping loaded files that have not changed
+             note: changed files are loaded again on demand
+
             :type handler: FileDfsHandler or None
+            :return: changes since the last rescan (all files are added in the first one)
+            :rtype: FilesDiff
         """
-        dir_stack = []
         if handler:
             handler.project = self
             handler.setup()
 
-        project_root = self.abs_path
-        for r, d, files in os.walk(project_root):
-            dir_path = self.build_relative_path(r)
-            ignored = False
-            for ignored_dir in self.ignored_dirs:
-                if dir_path.startswith(ignored_dir):
-                    ignored = True
-                    break
-            if ignored:
-                continue
-            if handler:
-                while dir_stack and not dir_path.startswith(dir_stack[-1]):
-                    handler.exit_dir(dir_stack.pop())
-                dir_stack.append(dir_path)
-                handler.enter_dir(dir_path)
-            for f in files:
-                path = self.build_relative_path(os.path.join(r, f))
-                self.file_extensions.add(get_extension(path))
-                self._files[path] = None
+        files_stat = {}
+        for event, path, st in walk_tree(self.abs_path, self.is_ignored):
+            if event == WalkEvent.FILE:
+                files_stat[path] = (st.st_mtime, st.st_size)
                 if handler:
                     handler.handle_file(path)
+            elif handler:
+                if event == WalkEvent.ENTER_DIR:
+                    handler.enter_dir(path)
+                else:
+                    handler.exit_dir(path)
 
         if handler:
-            while dir_stack:
-                handler.exit_dir(dir_stack.pop())
             handler.tear_down()
 
+        return self._update_files(files_stat)
+
+    def is_ignored(self, path, is_dir):
+        """ Determine if the file or directory (given by relative path) is excluded from the project
+        """
+        if is_dir:
+            for ignored_dir in self.ignored_dirs:
+                if path.startswith(ignored_dir):
+                    return True
+        return self.gitignore is not None and self.gitignore.match(path, is_dir)
+
+    def load_gitignore(self):
+        """ Load ignore patterns from the .gitignore file in project root, the .git directory is always ignored
+        """
+        path = self.build_path('.gitignore')
+        if os.path.isfile(path):
+            self.gitignore = GitIgnore.from_file(path, ['/.git/'])
+        else:
+            self.gitignore = GitIgnore(['/.git/'])
+
+    def _update_files(self, files_stat):
+        """ Update the files cache to the given scan result, returning the changes
+
+            :param dict files_stat: (mtime, size) of all files, by relative path
+            :rtype: FilesDiff
+        """
+        old_stat = self._files_stat
+        added, changed = [], []
+        for path, stat in files_stat.iteritems():
+            old = old_stat.get(path)
+            if old is None:
+                added.append(path)
+                self._files[path] = None
+            elif old != stat or path not in self._files:
+                changed.append(path)
+                self._files[path] = None
+        removed = [path for path in old_stat if path not in files_stat]
+        for path in removed:
+            self._files.pop(path, None)
+        for path in changed + removed:
+            self.symbols.remove_file(path)
+        if changed or removed:
+            stale = set(changed + removed)
+            self._declared_paths = dict((k, v) for k, v in self._declared_paths.iteritems() if v not in stale)
+        if added or removed:
+            self._index_qualified_paths(files_stat)
+
+        self._files_stat = files_stat
+        self.file_extensions = set(get_extension(path) for path in files_stat)
+        if added or changed or removed:
+            self.generation += 1
+        return FilesDiff(sorted(added), sorted(changed), sorted(removed))
+
     def filter_files(self, cond=None, extension=None):
         """ Return filenames of files in this project that satisfy the condition function
 
@@ -160,15 +266,9 @@ class Project(LocatableInterface):
             is_qualified = not ('/' in path or '\\' in path)
 
         if is_qualified:
-           # java dotted format
-            found = False
-            rel_path = os.path.join(*path.split('.'))
-            for sr in self.source_roots:
-                if os.path.join(sr, rel_path) + '.java' in self.files:
-                    rel_path = os.path.join(sr, rel_path) + '.java'
-                    found = True
-                    break
-            if not found:
+            # java dotted format
+            rel_path = self.find_qualified_path(path)
+            if rel_path is None:
                 raise KeyError('File not found in project source roots: {0}'.format(path))
         else:
             rel_path = self.build_relative_path(path)
@@ -176,20 +276,205 @@ class Project(LocatableInterface):
         # file cache
         f = self.files[rel_path]
         if f is None:
-            f = self.files[rel_path] = self.load_file(rel_path)
-            f.project_path = rel_path
+            f = self._get_cached_file(rel_path)
+            if f is None:
+                f = self.load_file(rel_path)
+            self._add_loaded_file(rel_path, f)
         return f
 
+    def _add_loaded_file(self, rel_path, f):
+        self.files[rel_path] = f
+        f.project_path = rel_path
+        if isinstance(f, SourceFile):
+            if f.parsed:
+                self._index_parsed_file(f)
+            else:
+                f.parsed_callback = self._on_file_parsed
+
+    def _on_file_parsed(self, f):
+        if self._files.get(f.project_path) is not f:
+            return  # the file is changed (or removed) since it is loaded
+        self._cache_file(f)
+        self._index_parsed_file(f)
+
+    def _index_parsed_file(self, f):
+        rel_path = f.project_path
+        self.symbols.add_file(rel_path, f)
+        if isinstance(f.package, basestring):
+            name = os.path.splitext(rel_path.split('/')[-1])[0]
+            self._declared_paths[f.package + '.' + name] = rel_path
+
+    def find_qualified_path(self, qualified_name):
+        """ Return relative path of the java file with the given dotted name, or None if there is no such file
+             the name is relative to a source root (the first matching root is used), or to the package
+             declared in the file if the file is parsed before
+
+            :param str qualified_name: e.g. 'a.b.C' for 'src/a/b/C.java'
+        """
+        files = self.files  # scanning the files if not scanned yet
+        if self._qualified_roots != self.source_roots:
+            self._index_qualified_paths(files)
+        rel_path = self._qualified_paths.get(qualified_name)
+        if rel_path is None:
+            rel_path = self._declared_paths.get(qualified_name)
+        return rel_path
+
+    def _index_qualified_paths(self, paths):
+        self._qualified_paths = {}
+        self._qualified_roots = list(self.source_roots)
+        for sr in reversed(self._qualified_roots):  # so the first matching root wins
+            prefix = sr.strip('/') + '/' if sr.strip('/') else ''
+            for path in paths:
+                if path.endswith('.java') and path.startswith(prefix):
+                    name = path[len(prefix):-5]
+                    if '.' not in name:
+                        self._qualified_paths[name.replace('/', '.')] = path
+
+    @property
+    def _cache_tag(self):
+        # files parsed in different modes are cached separately
+        return '{0}:{1}'.format(type(self).__name__, ParseMode.reverse[self.parse_mode])
+
+    def _get_cached_file(self, rel_path):
+        if self.snapshot is not None:
+            f = self.snapshot.get_file(rel_path, self._files_stat.get(rel_path))
+            if f is not None:
+                return f
+        if self.parse_cache is None:
+            return None
+        return self.parse_cache.get(self.build_path(rel_path), tag=self._cache_tag)
+
+    def open_snapshot(self, filename):
+        """ Read the parsed files from the snapshot from now on, instead of parsing them
+             note: the snapshot is not used if it is saved by another parser version or in another parse mode
+
+            :param str filename: the snapshot file, see save_snapshot
+            :return: whether the snapshot is used
+            :raise inspector.models.serialization.SerializationError: if the file is not a valid snapshot
+        """
+        snapshot = ProjectSnapshot(filename)
+        if not snapshot.is_current or snapshot.tag != self._cache_tag:
+            snapshot.close()
+            return False
+        self.close_snapshot()
+        self.snapshot = snapshot
+        return True
+
+    def close_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def save_snapshot(self, filename, workers=None):
+        """ Parse all files of the project, and save them in a snapshot for the next runs (see open_snapshot)
+
+            :return: failures of the files that could not be loaded
+            :rtype: list of ParseFailure
+        """
+        return ProjectSnapshot.save(self, filename, workers=workers)
+
+    def _cache_file(self, f):
+        if self.parse_cache is not None and isinstance(f, SourceFile) and f.parsed:
+            self.parse_cache.put(f, tag=self._cache_tag)
+
     def get_files(self, filenames):
         return (self.get_file(filename) for filename in filenames)
 
     def all_files(self):
         """ Return an iterator of all files in the project
-            note: returned files are parsed, so this may take a while for large projects
+            note: source files are parsed on first access to their models, so this may take a while
+                  for large projects if the models are used
             note: use filter_files or get_files for returning a subset of all project files
         """
         return self.get_files(self.files)
 
+    def parse_statistics(self):
+        """ Return how many of the project files are loaded and parsed, e.g. to check that parsing is
+             deferred as expected
+
+            :rtype: ParseStatistics
+        """
+        loaded = [f for f in self.files.itervalues() if f is not None]
+        parsed = [f for f in loaded if isinstance(f, SourceFile) and f.parsed]
+        return ParseStatistics(len(self.files), len(loaded), len(parsed), sum(f.parse_time or 0. for f in parsed))
+
+    def parse_all(self, workers=None):
+        """ Load and parse all files of the project that are not loaded yet, using a pool of worker
+             processes. Loaded files are added to the files cache, just like get_file does.
+             note: a file that can not be parsed does not stop the others, it is reported instead
+
+            :param int or None workers: number of worker processes, defaults to the cpu count,
+                                        1 parses the files in this process
+            :return: failures of the files that could not be loaded
+            :rtype: list of ParseFailure
+        """
+        paths = [path for path, f in self.files.iteritems() if f is None]
+        failures = []
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        if workers <= 1 or len(paths) <= 1:
+            for path in paths:
+                try:
+                    f = self.get_file(path, is_qualified=False)
+                    if isinstance(f, SourceFile):
+                        f.ensure_parsed()
+                except Exception as e:
+                    failures.append(ParseFailure(path, type(e).__name__, unicode(e)))
+            return failures
+
+        if self.parse_cache is not None or self.snapshot is not None:
+            not_cached = []
+            for path in paths:
+                f = self._get_cached_file(path)
+                if f is None:
+                    not_cached.append(path)
+                else:
+                    self._add_loaded_file(path, f)
+            paths = not_cached
+            if not paths:
+                return failures
+
+        pool = multiprocessing.Pool(workers, initializer=_init_parse_worker, initargs=(self._worker_copy(),))
+        try:
+            chunk_size = max(1, len(paths) // (workers * 4))
+            for path, f, failure in pool.imap_unordered(_parse_file_worker, paths, chunk_size):
+                if failure is not None:
+                    failures.append(failure)
+                else:
+                    self._cache_file(f)
+                    self._add_loaded_file(path, f)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return failures
+
+    def export_tables(self, workers=None):
+        """ Parse all files of the project, and return the models of the parsed source files as columnar tables
+             note: the files that can not be parsed are not exported, see parse_all
+
+            :rtype: ModelTables
+        """
+        self.parse_all(workers=workers)
+        tables = ModelTables()
+        for path in sorted(self.files):
+            f = self.files[path]
+            if isinstance(f, SourceFile) and f.parsed:
+                tables.add_file(path, f)
+        return tables
+
+    def _worker_copy(self):
+        """ Return a copy of this project that is cheap to send to parse_all workers
+        """
+        project = copy.copy(self)
+        project._files = {}
+        project.parse_cache = None  # the results are cached by the main process
+        project.snapshot = None
+        return project
+
     def dfs_files(self, handler):
         """
             :type handler: FileDfsHandler
@@ -201,22 +486,54 @@ class Project(LocatableInterface):
     ####################
     #  Find Utilities  #
     ####################
+    def find_symbol(self, kind, qualified_name):
+        """ Return the symbol of the given kind ('class', 'interface', 'method' or 'field') and qualified name
+             note: if the symbol is not indexed yet, the file it is probably defined in is loaded first
+
+            :rtype: inspector.models.symbols.Symbol or None
+        """
+        symbol = self.symbols.get(kind, qualified_name)
+        if symbol is None and self.snapshot is not None:
+            rel_path = self.snapshot.symbol_path(kind, qualified_name)
+            if rel_path is not None and rel_path in self.files:
+                f = self.get_file(rel_path, is_qualified=False)
+                if isinstance(f, SourceFile):
+                    f.ensure_parsed()
+                symbol = self.symbols.get(kind, qualified_name)
+        if symbol is None:
+            # guessing the file by the longest matching prefix, e.g. a/b/C.java for a.b.C.Inner$1.m
+            class_name = qualified_name if kind in ['class', 'interface'] else qualified_name.rsplit('.', 1)[0]
+            p = class_name.split('$', 1)[0].split('.')
+            for i in range(len(p), 0, -1):
+                try:
+                    f = self.get_file('.'.join(p[:i]))
+                except KeyError:
+                    continue
+                if isinstance(f, SourceFile):
+                    f.ensure_parsed()
+                symbol = self.symbols.get(kind, qualified_name)
+                break
+            else:
+                raise KeyError('File not found in project source roots: {0}'.format(qualified_name))
+        return symbol
+
     def find_class(self, qualified_name):
-        p = qualified_name.split('.')
-        class_name = p[-1]
-        try:
-            class_file = self.get_file('.'.join(p[:-1]))
-        except KeyError:
-            # the user can omit the class_name if class_name == filename (e.g. a.b.ClassName.ClassName)
-            # TODO: consider other languages like python! they maybe need camel case conversion
-            class_file = self.get_file('.'.join(p))
-        return class_file.get_class(class_name)
+        symbol = self.find_symbol('class', qualified_name)
+        return symbol.model if symbol else None
+
+    def build_symbol_index(self, workers=None):
+        """ Load all project files, so all symbols are indexed
+
+            :return: failures of the files that could not be loaded
+            :rtype: list of ParseFailure
+        """
+        return self.parse_all(workers=workers)
 
     def find(self, identifier):
-        """ Find the code object (file/class/method/etc.) specified by the
+        """ Find the code object (file/class/interface/method/field) specified by the
              identifier in this project.
 
-            :param str identifier: object to find, e.g. 'class:a.b.X', 'file:a.b.f'
+            :param str identifier: object to find, e.g. 'class:a.b.X', 'file:a.b.f', 'method:a.b.X$1.run'
         """
         try:
             id_type, id_val = identifier.split(':', 1)
@@ -224,19 +541,30 @@ class Project(LocatableInterface):
             raise ValueError('Invalid identifer: {0}'.format(identifier))
         if id_type == 'file':
             return self.get_file(id_val)
-        if id_type == 'class':
-            return self.find_class(id_val)
-        if id_type == 'method':
-            ind = id_val.rfind('.')
-            method_class = self.find_class(id_val[:ind])
-            return method_class.get_method(id_val[ind+1:])
+        if id_type in SymbolIndex.KINDS:
+            symbol = self.find_symbol(id_type, id_val)
+            return symbol.model if symbol else None
         raise ValueError('Invalid identifier: {0}'.format(id_type))
 
     ############################
     #  File Loading & Parsing  #
     ############################
     def load_file(self, rel_path):
-        return File(self.build_path(rel_path))
+        """ Create the model of a project file, source files must be created using self.parse_mode
+        """
+        return File(self.build_path(rel_path), use_mmap=self.should_mmap(rel_path))
+
+    def should_mmap(self, rel_path):
+        """ Determine if the content of the file should be memory-mapped instead of being read
+             note: set mmap_threshold to None to disable memory-mapping
+        """
+        if self.mmap_threshold is None:
+            return False
+        if rel_path in self._files_stat:
+            size = self._files_stat[rel_path][1]  # from the last scan
+        else:
+            size = os.path.getsize(self.build_path(rel_path))
+        return size >= self.mmap_threshold
 
     def auto_detect_roots(self):
         if os.path.isdir(self.build_path('src')):
@@ -256,17 +584,34 @@ class Package(LocatableInterface):
 
 
 class File(LocatableInterface):
-    def __init__(self, filename, preload=False):
+    def __init__(self, filename, preload=False, use_mmap=False):
+        """
+            :param str filename: the disk filename of the file
+            :param bool preload: whether to load the content now, instead of on demand
+            :param bool use_mmap: whether to memory-map the content instead of reading it into a string,
+                                  the mapping supports indexing, slicing, find and re like a str does
+        """
         self.file_content = None
+        self.content_stat = None  # (mtime, size) of the file when the content is loaded, i.e. of the models
         self._file_size = None
+        self._line_index = None
         self._lines = None
         self.filename = filename
         self.project_path = None  # project relative path
+        self.use_mmap = use_mmap
 
         # setup
         if preload:
             self.load_content()
 
+    def __getstate__(self):
+        # the content is not pickled, it is loaded again when needed
+        state = self.__dict__.copy()
+        state['file_content'] = None
+        state['_line_index'] = None
+        state['_lines'] = None
+        return state
+
     def get_abs_path(self):
         return self.filename
 
@@ -284,11 +629,34 @@ class File(LocatableInterface):
     def load_content(self, reload=True):
         if not reload and self.loaded:
             return
-        # TODO: this is 2X memory!
+        self.unload_content()
         with open(self.get_abs_path(), 'r') as f:
-            self.file_content = f.read()
+            st = os.fstat(f.fileno())
+            self.content_stat = (st.st_mtime, st.st_size)
+            if self.use_mmap:
+                try:
+                    self.file_content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    self.file_content = ''  # empty files can not be mapped
+            else:
+                self.file_content = f.read()
+
+    def unload_content(self):
+        """ Release the loaded content (closing the mapping if it is memory-mapped)
+        """
+        if isinstance(self.file_content, mmap.mmap):
+            self.file_content.close()
+        self.file_content = None
+        self._line_index = None
+        self._lines = None
+
+    def read_head(self, size):
+        """ Return the first size chars of the file, without loading the whole content
+        """
+        if self.loaded:
+            return self.file_content[:size]
         with open(self.get_abs_path(), 'r') as f:
-            self._lines = f.readlines()
+            return f.read(size)
 
     def detect_language(self):
         ext = os.path.splitext(self.filename)[1]
@@ -307,10 +675,26 @@ class File(LocatableInterface):
             ln = ln[:-1]
         return ln
 
+    @property
+    def line_index(self):
+        """ Newline offsets of the file content, shared by lines and the parser
+
+            :rtype: LineIndex
+        """
+        if self._line_index is None:
+            self.load_content(reload=False)
+            self._line_index = LineIndex(self.file_content)
+        return self._line_index
+
     @property
     def lines(self):
+        """ Lines of the file (including the \\n's), sliced from the file content on access
+
+            :rtype: LinesView
+        """
         if self._lines is None:
-            self.load_content(reload=False)
+            line_index = self.line_index  # loads the content if needed
+            self._lines = LinesView(self.file_content, line_index)
         return self._lines
 
     @property
@@ -318,6 +702,22 @@ class File(LocatableInterface):
         # TODO: this functions returns 1 extra line for some files
         return len(self.lines)
 
+    def get_span(self, start, end):
+        """ Return the content between the given offsets, e.g. code of a model stored by its location
+             note: the content is loaded again if it is unloaded (e.g. for the models read from a cache)
+
+            :raise ContentChangedError: if the file is changed since the content was loaded before, as the
+                                        offsets are of the old content
+        """
+        if not self.loaded:
+            old_stat = self.content_stat
+            self.load_content(reload=False)
+            if old_stat is not None and not same_stat(old_stat, self.content_stat):
+                self.unload_content()
+                self.content_stat = old_stat  # the models are still of the old content
+                raise ContentChangedError('File changed since it is parsed: {0}'.format(self.get_abs_path()))
+        return self.file_content[start:end]
+
     @property
     def chars_count(self):
         self.load_content(reload=False)
@@ -333,6 +733,8 @@ class Directory(LocatableInterface):
 
 
 class Coverable(object):
+    __slots__ = ()  # _coverage is stored by the subclasses
+
     def __init__(self):
         self._coverage = None
 
@@ -370,29 +772,29 @@ class Coverable(object):
 
 
 class SourceFile(File, FileTokenizer, Coverable):
-    def __init__(self, filename, package=None):
-        """ Create a parsed SourceFile model from the file
-             note: parsing is done in the constructor
+    def __init__(self, filename, package=None, use_mmap=False, parse_mode=ParseMode.FULL):
+        """ Create a SourceFile model from the file
+             note: parsing is deferred until the models (classes, imports, etc.) are accessed,
+                   or ensure_parsed is called
              note: if file's language can not be detected, parsing is not done
 
             :param str filename: file to e read and parsed
             :param package: the containing package of this file
+            :param bool use_mmap: whether to parse the memory-mapped content, see File
+            :param int parse_mode: a ParseMode, e.g. HEADERS for not parsing the method bodies
         """
 
-        super(SourceFile, self).__init__(filename)
+        super(SourceFile, self).__init__(filename, use_mmap=use_mmap)
         Coverable.__init__(self)
         FileTokenizer.__init__(self)
         self.package = package
+        self.parse_mode = parse_mode
 
         # parse results
         self.parsed = False
-        self.imports = []
-        self.globals = []
-        self.classes = []
-        self.functions = []
-
-        # loading and parsing
-        self.load_content()
+        self.parse_time = None  # in seconds
+        self.parsed_callback = None  # called with this file after parsing it, e.g. by the project
+        self._clear_models()
 
     def __unicode__(self):
         msg = u'{lang} SourceFile: {content}'
@@ -412,18 +814,74 @@ class SourceFile(File, FileTokenizer, Coverable):
     def __str__(self):
         return unicode(self)
 
+    def __getstate__(self):
+        state = super(SourceFile, self).__getstate__()
+        # dropping the parser state, only the parsed model is kept
+        for k in ['_context', '_context_tops', '_last_popped', 'sw', 'statement_pre_read']:
+            state.pop(k, None)
+        state['_parse_head'] = 0
+        state['L'] = 0
+        state['parsed_callback'] = None
+        return state
+
+    ############
+    #  Models  #
+    ############
+    @property
+    def imports(self):
+        self.ensure_parsed()
+        return self._imports
+
+    @property
+    def globals(self):
+        self.ensure_parsed()
+        return self._globals
+
+    @property
+    def classes(self):
+        self.ensure_parsed()
+        return self._classes
+
+    @property
+    def functions(self):
+        self.ensure_parsed()
+        return self._functions
+
+    def _clear_models(self):
+        self._imports = []
+        self._globals = []
+        self._classes = []
+        self._functions = []
+
+    def ensure_parsed(self):
+        """ Parse the file if it is not parsed yet (loading the content if needed)
+        """
+        if self.parsed or not self.language_detected:
+            return
+        with _get_parse_lock(self):
+            if self.parsed:
+                return  # parsed by another thread meanwhile
+            self.load_content(reload=False)
+            start = time.time()
+            self._parse()
+            self.parse_time = time.time() - start
+            if self.parsed_callback is not None:
+                with _parsed_callback_lock:
+                    self.parsed_callback(self)
+
     @property
     def project(self):
-        return self.package.project if self.package else None
+        # note: package is the declared package name (a str) after parsing some languages
+        return self.package.project if isinstance(self.package, Package) else None
 
     def get_abs_path(self):
-        pkg_abs = self.package.abs_path if self.package else ''
+        pkg_abs = self.package.abs_path if isinstance(self.package, Package) else ''
         return os.path.join(pkg_abs, self.filename)
 
     # noinspection PyShadowingBuiltins
     def load_content(self, reload=True):
-        """ Read the content of this SourceFile, and fully parse it if the
-             programming language is detected
+        """ Read the content of this SourceFile, parsing it again if it is reloaded after parsing
+             note: parsing is not done here for the first time, see ensure_parsed
 
             :param bool reload: wheter to reload the content if it is already loaded before
         """
@@ -431,8 +889,7 @@ class SourceFile(File, FileTokenizer, Coverable):
             return
         super(SourceFile, self).load_content(reload=reload)
         self.set_content(self.file_content)
-        if self.language_detected:
-            # TODO: parse should be done only if content is not loaded yet or reload is True
+        if self.parsed and reload:
             self._parse()
 
     ##########################
@@ -473,16 +930,74 @@ class SourceFile(File, FileTokenizer, Coverable):
                 return c
         return default
 
+    def context_push(self, token):
+        """ Push the token to the context stack, keeping track of the innermost class, function, block and switch
+             of the context (see context_class, etc.)
+
+            :param inspector.parser.base.Token token: the token of a block being opened
+        """
+        cls, func, block, switch = self._context_tops[-1] if self._context_tops else (None, None, None, None)
+        if token.isinstance(CodeBlock):
+            block = token
+            if token.isinstance(Class):
+                cls = token
+            elif token.isinstance(Function):
+                func = token
+            elif token.isinstance(SwitchBlock):
+                switch = token
+        self._context.append(token)
+        self._context_tops.append((cls, func, block, switch))
+
     def context_pop(self):
         """
             :rtype: inspector.parser.base.Token
         """
         p = self._context.pop()
+        self._context_tops.pop()
         # print "poped:", p.model
         if p.isinstance(CodeBlock):
             self._last_popped = p
         return p
 
+    def _context_top_of(self, kind):
+        return self._context_tops[-1][kind] if self._context_tops else None
+
+    @property
+    def context_class(self):
+        """ The innermost Class token of the context, or None
+            :rtype: inspector.parser.base.Token
+        """
+        return self._context_top_of(0)
+
+    @property
+    def context_function(self):
+        """ The innermost Function token of the context, or None
+            :rtype: inspector.parser.base.Token
+        """
+        return self._context_top_of(1)
+
+    @property
+    def context_block(self):
+        """ The innermost CodeBlock token of the context, or None
+            :rtype: inspector.parser.base.Token
+        """
+        return self._context_top_of(2)
+
+    @property
+    def context_switch(self):
+        """ The innermost SwitchBlock token of the context, or None
+            :rtype: inspector.parser.base.Token
+        """
+        return self._context_top_of(3)
+
+    def iter_tokens(self):
+        """ Yield the tokens of the file, with their line spans, without building the models
+             (i.e. independent of the parse results), see e.g. inspector.models.java.JavaTokenStream
+
+            :rtype: collections.Iterable[inspector.parser.base.Token]
+        """
+        raise NotImplementedError()
+
     def next_token(self):
         """ Get the next language-specific token of the file (relative to read head)
              This abstract method is where subclasses define language-specific parsing
@@ -496,14 +1011,14 @@ class SourceFile(File, FileTokenizer, Coverable):
 
     def _save_model(self, token_model):
         if isinstance(token_model, Import):
-            self.imports.append(token_model)
+            self._imports.append(token_model)
             token_model.source_file = self
         elif isinstance(token_model, Class):
-            self.classes.append(token_model)
+            self._classes.append(token_model)
         elif isinstance(token_model, Function):
-            self.functions.append(token_model)
+            self._functions.append(token_model)
         else:
-            self.globals.append(token_model)
+            self._globals.append(token_model)
 
     def _parse(self):
         """ Extract SourceFile data by parsing the code, result is saved in object's attributes.
@@ -511,7 +1026,10 @@ class SourceFile(File, FileTokenizer, Coverable):
              part is done using the abstract self.next_token() method
         """
         logger.debug('Parsing file: %s', self.filename)
+        self.set_content(self.file_content)
+        self._clear_models()
         self._context = []
+        self._context_tops = []  # (class, function, block, switch) innermost tokens, for each context level
         self._last_popped = None
         self.statement_pre_read = None
         self.sw = None
@@ -521,7 +1039,10 @@ class SourceFile(File, FileTokenizer, Coverable):
                 continue
             if token.model is None:
                 continue
-            if self.find_context_top(cond=lambda x: x != token and x.isinstance(CodeBlock)) is None:
+            depth = len(self._context)
+            if depth and self._context[-1] is token:
+                depth -= 1  # the token itself is not its parent
+            if not depth or self._context_tops[depth - 1][2] is None:
                 # this token model has no parents, we must save it separately
                 self._save_model(token.model)
         self.parsed = True
@@ -537,14 +1058,19 @@ class SourceFile(File, FileTokenizer, Coverable):
         lng = File(filename).detect_language()
         if lng == Language.JAVA:
             from inspector.models import java
-            return java.JavaSourceFile(filename, package=package)
+            sf = java.JavaSourceFile(filename, package=package)
         elif lng == Language.PYTHON:
             from inspector.models import python
-            return python.PythonSourceFile(filename, package=package)
-        raise ValueError('Unknown language')
+            sf = python.PythonSourceFile(filename, package=package)
+        else:
+            raise ValueError('Unknown language')
+        sf.ensure_parsed()
+        return sf
 
 
 class Import(object):
+    __slots__ = ('import_str', 'source_file')
+
     def __init__(self, import_str, source_file=None):
         """
             :param str or unicode import_str: the string used to import the identifier
@@ -571,13 +1097,17 @@ class Import(object):
 
         identifier = self.imported_identifier
         usage_lines = []
-        for i, l in enumerate(self.source_file._lines):
+        for i, l in enumerate(self.source_file.lines):
             if has_word(l, identifier):
                 usage_lines.append(i + 1)
         return usage_lines
 
 
 class CodeBlock(Coverable):
+    # models of statements, blocks and methods are created for every few lines of code, so they are kept
+    #  compact, subclasses with few instances (e.g. Class) still have a __dict__
+    __slots__ = ('_coverage', 'parent_block', 'statements', 'starting_line', 'ending_line')
+
     def __init__(self):
         Coverable.__init__(self)
         self.parent_block = None
@@ -621,6 +1151,8 @@ class CodeBlock(Coverable):
 
 
 class Class(CodeBlock):
+    kind = 'class'
+
     def __init__(self, name, source_file=None, package=None, parent_class=None, extends=None):
         super(Class, self).__init__()
         self.name = name
@@ -629,6 +1161,7 @@ class Class(CodeBlock):
         self._package = package
         self.methods = []
         self.fields = []
+        self.nested_classes = []  # named classes defined in this class (anonymous ones are in their methods)
         if not extends:
             self.extends = []
         else:
@@ -696,6 +1229,8 @@ class Class(CodeBlock):
 
 
 class Field(object):
+    __slots__ = ('name', 'type', 'parent_class', 'visibility', 'is_static', 'annotations', 'initializer')
+
     def __init__(self, name, field_type, parent_class, visibility=None, annotations=None, initializer=None,
                  is_static=False):
         self.name = name
@@ -714,6 +1249,8 @@ class Field(object):
 
 
 class Function(CodeBlock):
+    __slots__ = ('name', 'source_file', 'arguments', 'return_type', 'binding')
+
     def __init__(self, name, source_file=None, return_type=None, arguments=None):
         super(Function, self).__init__()
         self.name = name
@@ -735,6 +1272,7 @@ class Method(Function):
                   verbose_names=['unknown', 'private', 'protected', 'package', 'public', 'published'])
     BINDING = enum('UNKNOWN', 'UNBOUND', 'STATIC', 'CLASS', 'INSTANCE',
                    verbose_names=['unknown', 'unbound', 'static', 'class', 'instance'])
+    __slots__ = ('parent_class', 'access', 'abstract', 'throws', 'nested_classes', 'nested_functions')
 
     def __init__(self, parent_class, name, return_type=None, arguments=None, access=None, binding=None, abstract=False,
                  throws=None):
@@ -808,24 +1346,48 @@ class Method(Function):
 
 
 class Comment(object):
-    def __init__(self, content):
-        """
-            :param str or unicode content: comment content, including // or /* */
+    __slots__ = ('_text', 'source_file', 'start', 'end', 'doc_comment', 'starting_line', 'ending_line', 'multiline')
+    LINE_COMMENT_RE = re.compile(r'^//(/|\s)*')
+    BLOCK_COMMENT_RE = re.compile(r'(^/\*(\*|\s)*|(\*|\s)*\*/$)')
+
+    def __init__(self, content=None, source_file=None, start=None, end=None):
+        """ Create a comment from its code, or from its location in a source file (the code is not copied then)
+
+            :param str or unicode content: comment code, including // or /* */
+            :param SourceFile source_file: the source file containing the comment
+            :param int start: offset of the comment in the source file content
+            :param int end: offset of the end of the comment (exclusive)
         """
-        self.content = content
-        self.doc_comment = self.content.startswith(u'/**')
+        self._text = content
+        self.source_file = source_file
+        self.start = start
+        self.end = end
         self.starting_line = None
         self.ending_line = None
 
-        if self.content.startswith('//'):
+        prefix = content[:3] if content is not None else source_file.get_span(start, min(start + 3, end))
+        self.doc_comment = prefix.startswith(u'/**')
+        if prefix.startswith('//'):
             self.multiline = False
-            pat = r'^//(/|\s)*'
-        elif self.content.startswith('/*'):
+        elif prefix.startswith('/*'):
             self.multiline = True
-            pat = r'(^/\*(\*|\s)*|(\*|\s)*\*/$)'
         else:
             raise ValueError(u'Invalid comment start.')
-        self.content = re.sub(pat, '', self.content)
+
+    @property
+    def source_text(self):
+        """ The comment as it is in the source code, including // or /* */
+        """
+        if self._text is None:
+            return self.source_file.get_span(self.start, self.end)
+        return self._text
+
+    @property
+    def content(self):
+        """ Text of the comment, without // or /* */
+        """
+        pat = self.BLOCK_COMMENT_RE if self.multiline else self.LINE_COMMENT_RE
+        return pat.sub('', self.source_text)
 
     def __unicode__(self):
         u = u'Comment: {0}'.format(summarize(self.content, max_len=10))
@@ -838,8 +1400,26 @@ class Comment(object):
 
 
 class Statement(object):
-    def __init__(self, code):
-        self.code = code
+    __slots__ = ('_code', 'source_file', 'start', 'end')
+
+    def __init__(self, code=None, source_file=None, start=None, end=None):
+        """ Create a statement from its code, or from its location in a source file (the code is not copied then)
+
+            :param str or unicode code: code of the statement
+            :param SourceFile source_file: the source file containing the statement
+            :param int start: offset of the statement in the source file content
+            :param int end: offset of the end of the statement (exclusive)
+        """
+        self._code = code
+        self.source_file = source_file
+        self.start = start
+        self.end = end
+
+    @property
+    def code(self):
+        if self._code is None:
+            return self.source_file.get_span(self.start, self.end)
+        return self._code
 
     def __unicode__(self):
         return u'Statement: {0}'.format(summarize(self.code, max_len=0))
@@ -849,6 +1429,8 @@ class Statement(object):
 
 
 class IfBlock(CodeBlock):
+    __slots__ = ('condition', 'mode', 'elifs', 'else_block')
+
     def __init__(self, condition):
         super(IfBlock, self).__init__()
         self.condition = condition
@@ -876,6 +1458,10 @@ class IfBlock(CodeBlock):
 
 
 class SwitchBlock(CodeBlock):
+    __slots__ = ('condition', 'cases', 'case_orders', 'mode', 'default', 'active_cases')
+    BREAK_RE = re.compile(r'^break\s*;$')
+    RETURN_RE = re.compile(r'^return\b.*;$', re.DOTALL)
+
     def __init__(self, condition):
         super(SwitchBlock, self).__init__()
         self.condition = condition
@@ -903,9 +1489,9 @@ class SwitchBlock(CodeBlock):
 
     def add_statement(self, statement):
         if statement and isinstance(statement, Statement) and statement.code:
-            if re.match(r'^break\s*;$', statement.code.strip()):
+            if self.BREAK_RE.match(statement.code.strip()):
                 self.mode = 'break'
-            if re.match(r'^return\b.*;$', statement.code.strip(), re.DOTALL):
+            if self.RETURN_RE.match(statement.code.strip()):
                 self.mode = 'return'
         if not self.active_cases and not self.mode:
             raise ValueError('Statement not in a case: {0}.'.format(unicode(statement)))
@@ -925,6 +1511,8 @@ class SwitchBlock(CodeBlock):
 
 
 class ExceptionBlock(CodeBlock):
+    __slots__ = ('catches', 'active_catch', 'finally_block', 'else_block')
+
     def __init__(self):
         super(ExceptionBlock, self).__init__()
         self.catches = {}
@@ -955,20 +1543,28 @@ class ExceptionBlock(CodeBlock):
 
 
 class ForBlock(CodeBlock):
+    __slots__ = ()
+
     def __unicode__(self):
         return u'ForBlock'
 
 
 class WhileBlock(CodeBlock):
+    __slots__ = ()
+
     def __unicode__(self):
         return u'WhileBlock'
 
 
 class DoWhileBlock(WhileBlock):
+    __slots__ = ()
+
     def __unicode__(self):
         return u'DoWhileBlock'
 
 
 class WithBlock(CodeBlock):
+    __slots__ = ()
+
     def __unicode__(self):
         return u'WithBlock'
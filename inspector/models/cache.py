@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+
+from inspector.models.serialization import ModelReader, ModelWriter, SerializationError
+from inspector.parser.base import PARSER_VERSION
+
+
+class ParseCache(object):
+    """ On-disk cache of parsed file models, so unchanged files are not parsed again
+
+        Each file is saved in its own entry, keyed by the file path, modification time, size and content
+        hash. Entries saved by another PARSER_VERSION are ignored. When the entries take more than max_size
+        bytes, the least recently used ones are removed.
+        Entries are model files (see inspector.models.serialization) with a 'header' and a 'file' record,
+        so stale entries are detected without reading their models.
+    """
+    FORMAT_VERSION = 2
+    ENTRY_EXTENSION = '.cache'
+
+    def __init__(self, cache_dir, max_size=256 * 1024 * 1024):
+        """
+            :param str cache_dir: directory to save the entries in, created if not exists
+            :param int max_size: maximum total size of the entries in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._size = None  # total size of entries, computed on first use
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @property
+    def version(self):
+        return self.FORMAT_VERSION, PARSER_VERSION
+
+    @staticmethod
+    def content_hash(content):
+        return hashlib.sha1(content).hexdigest()
+
+    def entry_path(self, abs_path, tag=''):
+        """
+            :param str abs_path: the cached file
+            :param str tag: distinguishes different models of the same file, e.g. loaded by different projects
+        """
+        key = hashlib.sha1('{0}:{1}'.format(tag, abs_path)).hexdigest()
+        return os.path.join(self.cache_dir, key + self.ENTRY_EXTENSION)
+
+    def get(self, abs_path, tag=''):
+        """ Return the cached model of the file, or None if it is not cached or the file has changed
+
+            :rtype: inspector.models.base.File or None
+        """
+        entry_path = self.entry_path(abs_path, tag)
+        touched = False
+        try:
+            st = os.stat(abs_path)
+            with open(entry_path, 'rb') as f:
+                reader = ModelReader(f.read())
+            header = reader.read('header')
+            if header['version'] != self.version or header['path'] != abs_path:
+                return None
+            if header['size'] != st.st_size:
+                return None
+            if header['mtime'] != st.st_mtime:
+                # just touched files (e.g. by a checkout) are still valid if the content is the same
+                with open(abs_path, 'r') as content_file:
+                    if self.content_hash(content_file.read()) != header['hash']:
+                        return None
+                header['mtime'] = st.st_mtime
+                touched = True
+            file_obj = reader.read('file')
+        except (IOError, OSError, KeyError, SerializationError):
+            return None
+
+        file_obj.content_stat = (st.st_mtime, st.st_size)  # the content of the models, verified above
+
+        if touched:
+            # saving the new mtime, so the content is not hashed again on the next lookups
+            try:
+                self._write_entry(entry_path, header, file_obj)
+            except (IOError, OSError):
+                pass
+        else:
+            os.utime(entry_path, None)  # marking the entry as recently used
+        return file_obj
+
+    def put(self, file_obj, tag=''):
+        """
+            :type file_obj: inspector.models.base.File
+        """
+        abs_path = file_obj.get_abs_path()
+        st = os.stat(abs_path)
+        if file_obj.loaded:
+            content = file_obj.file_content  # hashing a mapped content does not copy it
+        else:
+            with open(abs_path, 'r') as f:
+                content = f.read()
+        header = {
+            'version': self.version,
+            'path': abs_path,
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'hash': self.content_hash(content),
+        }
+
+        self._write_entry(self.entry_path(abs_path, tag), header, file_obj)
+
+    def _write_entry(self, entry_path, header, file_obj):
+        total_size = self.total_size()
+        old_size = os.path.getsize(entry_path) if os.path.exists(entry_path) else 0
+        tmp_path = entry_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            with ModelWriter(f) as writer:
+                writer.write('header', header)
+                writer.write('file', file_obj)
+        os.rename(tmp_path, entry_path)  # readers never see half written entries
+
+        self._size = total_size + os.path.getsize(entry_path) - old_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        """ Return (path, size, last used time) of all entries
+        """
+        result = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.ENTRY_EXTENSION):
+                path = os.path.join(self.cache_dir, name)
+                st = os.stat(path)
+                result.append((path, st.st_size, st.st_mtime))
+        return result
+
+    def total_size(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self.entries())
+        return self._size
+
+    def evict(self):
+        """ Remove the least recently used entries, until the cache is not larger than max_size
+        """
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_size:
+                break
+            os.remove(path)
+            self._size -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
+        self._size = 0
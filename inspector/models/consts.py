@@ -5,3 +5,5 @@ from inspector.utils.lang import enum
 Language = enum('UNKNOWN', 'JAVA', 'PYTHON', verbose_names=['Unknown', 'Java', 'Python'])
 JavaFrameworks = enum('ANDROID', verbose_names=['Android'])
 PythonFrameworks = enum('DJANGO', 'FLASK', verbose_names=['Django', 'Flask'])
+# how much of the source files is parsed: everything, or just the declarations (e.g. no statements in methods)
+ParseMode = enum('FULL', 'HEADERS', verbose_names=['Full', 'Headers only'])
@@ -1,5 +1,16 @@
 # -*- coding: utf-8 -*-
+from collections import namedtuple
 
 
 class ParseError(Exception):
     pass
+
+
+class ContentChangedError(Exception):
+    """ The file is changed since the models (and the offsets in them) are parsed
+    """
+    pass
+
+
+# the result of a failed file load, reported instead of raising when a batch of files is parsed
+ParseFailure = namedtuple('ParseFailure', ['path', 'error_type', 'message'])
@@ -3,9 +3,10 @@ import re
 import logging
 
 from inspector.parser.base import Token, LanguageSpecificParser
-from inspector.models.base import (Project, SourceFile, Class, Method, Import, Comment, Statement, ExceptionBlock,
+from inspector.parser.file_tokenizer import ScanCondition, FileTokenizer
+from inspector.models.base import (Project, File, SourceFile, Class, Method, Import, Comment, Statement, ExceptionBlock,
                                    CodeBlock, ForBlock, WhileBlock, IfBlock, Field, SwitchBlock, Function)
-from inspector.models.consts import Language
+from inspector.models.consts import Language, ParseMode
 from inspector.models.exceptions import ParseError
 from inspector.utils.arrays import find
 from inspector.utils.lang import enum
@@ -14,6 +15,13 @@ from inspector.utils.lang import enum
 logging.basicConfig(filename='logs.log', filemode='w', level=logging.DEBUG)
 logger = logging.getLogger('java_parser')
 
+PACKAGE_RE = re.compile(r'package\s+([a-zA-Z0-9_.]+)\s*;')
+CASE_RE = re.compile(r'^case\s+(?P<cond>.+?)\s*:')
+DEFAULT_RE = re.compile(r'^default\s*:')
+FIELD_NAME_RE = re.compile(r'^(\w+)(\s*=.+)?$', re.DOTALL)
+# braces, along with the comments and literals they must not be counted in, for skipping blocks
+BLOCK_SKIP_RE = re.compile(r'[{}]|//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+
 
 class JavaProject(Project):
     def load_file(self, rel_path):
@@ -22,18 +30,20 @@ class JavaProject(Project):
         """
         # TODO: determine package
         abs_path = self.build_path(rel_path)
+        use_mmap = self.should_mmap(rel_path)
         if rel_path.endswith('.java'):
-            return JavaSourceFile(abs_path, package=None)
-        return SourceFile(abs_path, package=None)
+            return JavaSourceFile(abs_path, package=None, use_mmap=use_mmap, parse_mode=self.parse_mode)
+        return SourceFile(abs_path, package=None, use_mmap=use_mmap, parse_mode=self.parse_mode)
 
 
-class IsNotBreaking(object):
+class IsNotBreaking(ScanCondition):
     """ Used to detect {}; in (), i.e. no-blocking ones
     """
 
     def __init__(self, breakings=None):
         self.breakings = breakings or ['{', '}', ';']
         self.par_open = 0
+        self.stop_re = re.compile('[()' + re.escape(''.join(self.breakings)) + ']')
 
     def __call__(self, ch):
         if ch == '(':
@@ -46,9 +56,10 @@ class IsNotBreaking(object):
         return True
 
 
-class IsNotStatementBreaking(object):
+class IsNotStatementBreaking(ScanCondition):
     """ Used to detect {}; in (), i.e. no-blocking ones
     """
+    stop_re = re.compile(r'[(){}\[\];]')
 
     def __init__(self, initial_open=0):
         self.par_open = initial_open
@@ -64,11 +75,33 @@ class IsNotStatementBreaking(object):
         return True
 
 
+def header_candidates(header):
+    """ Return the model classes that may parse the given {-terminated header, in the order they should be tried
+         only the leading keywords of the header are checked here, so most of the patterns are never matched
+
+        :param str header: the stripped header, e.g. 'public class A extends B'
+        :rtype: list of type
+    """
+    words = header.split(None, 2)
+    lead = words[0] if words else ''
+    second = words[1] if len(words) > 1 else ''
+    candidates = []
+    if lead.startswith('class') or second.startswith('class'):
+        candidates.append(JavaClass)
+    if 'new' in header:
+        candidates.append(JavaAnonymousClass)
+    if lead.startswith('synchronized'):
+        candidates.append(JavaSynchronizedBlock)
+    if lead.startswith('interface') or second.startswith('interface'):
+        candidates.append(JavaInterface)
+    if '(' in header:
+        candidates.append(JavaMethod)
+    return candidates
+
+
 class JavaSourceFile(SourceFile):
-    def __init__(self, filename, package=None):
-        self.interfaces = []  # shows Interfaces defined directly in this source file
-                              #  this is in addition to self.classes, java specific
-        super(JavaSourceFile, self).__init__(filename, package=package)
+    def __init__(self, filename, package=None, use_mmap=False, parse_mode=ParseMode.FULL):
+        super(JavaSourceFile, self).__init__(filename, package=package, use_mmap=use_mmap, parse_mode=parse_mode)
 
     def __unicode__(self):
         u = super(JavaSourceFile, self).__unicode__()
@@ -80,6 +113,17 @@ class JavaSourceFile(SourceFile):
     def language(self):
         return Language.JAVA
 
+    @property
+    def interfaces(self):
+        """ Interfaces defined directly in this source file, this is in addition to self.classes, java specific
+        """
+        self.ensure_parsed()
+        return self._interfaces
+
+    def _clear_models(self):
+        super(JavaSourceFile, self)._clear_models()
+        self._interfaces = []
+
     ##########################
     #  Model Access Helpers  #
     ##########################
@@ -92,9 +136,33 @@ class JavaSourceFile(SourceFile):
     #############
     #  Parsing  #
     #############
-    def add_statement(self, t, is_special_statement=False):
+    def iter_tokens(self):
+        self.load_content(reload=False)
+        return iter(JavaTokenStream(self.file_content))
+
+    def skip_block(self):
+        """ Skip the rest of the current block (after its {) without parsing it, e.g. a method body in
+             ParseMode.HEADERS, returning the line of the closing }
+
+            :rtype: int
+        """
+        depth = 1
+        for m in BLOCK_SKIP_RE.finditer(self.file_content, self.current_head()):
+            if m.group() == '{':
+                depth += 1
+            elif m.group() == '}':
+                depth -= 1
+                if not depth:
+                    self.rewind_to(m.end())
+                    return self.line_index.line_at(m.start())
+        raise ParseError(u'Unmatched {.')
+
+    def add_statement(self, t, is_special_statement=False, span=None):
+        """
+            :param (int, int) span: start and end offsets of the statement, if its content is read from the source
+        """
         t.type = 'statement'
-        t.model = JavaStatement.try_parse(t.content)
+        t.model = JavaStatement.try_parse(t.content, {u'source_file': self, u'span': span} if span else None)
         if t.model:
             if not is_special_statement:
                 ct = self.find_context_top()
@@ -123,53 +191,54 @@ class JavaSourceFile(SourceFile):
         prefix = self.read_ahead(2)
         if prefix == '//':
             t.type = 'comment'
-            l1 = self._cur_line
-            t.content = self.read(cond=lambda ch: ch != '\n')
-            t.model = Comment(t.content)
+            l1 = self.current_line()
+            start = self.current_head()
+            t.content = self.read(until='\n')
+            t.model = Comment(source_file=self, start=start, end=self.current_head())
             t.model.starting_line = l1
             t.model.ending_line = l1
         elif prefix == '/*':
             t.type = 'comment'
-            l1 = self._cur_line
+            l1 = self.current_line()
+            start = self.current_head()
             t.content = self.read(find='*/', beyond=2)
-            l2 = self._cur_line
-            t.model = Comment(t.content)
+            l2 = self.current_line()
+            t.model = Comment(source_file=self, start=start, end=self.current_head())
             t.model.starting_line = l1
             t.model.ending_line = l2
 
         else:
             # read up to the next blocking {};
-            l1 = self._cur_line
+            l1 = self.current_line()
             first_head = self.current_head()  # just if needed for rewinding
-            t.content = self.read(cond=lambda ch: ch not in ['{', '}', ';'])
+            t.content = self.read(until='{};')
             # in case of for declaration, reread to skip ; inside parentheses
             if t.content.startswith('for'):
                 self.rewind_to(first_head)
                 t.content = self.read(cond=IsNotBreaking())
             # gathering some more data for error reporting, just in case
-            l2 = self._cur_line
+            l2 = self.current_line()
             logger.debug('='*40)
             logger.debug('CONTENT:'+t.content if t.content is not None else '<NONE>')
 
             # finding parent blocks #
             # TODO: is it necessary to use parent_*block* here?
-            parent_class = self.find_context_top(lambda x: x.isinstance(Class))
+            parent_class = self.context_class
             if parent_class:
                 parent_class = parent_class.model
-            parent_function = self.find_context_top(lambda x: x.isinstance(Function))
+            parent_function = self.context_function
             if parent_function:
                 parent_function = parent_function.model
-            parent_block = self.find_context_top(lambda x: x.isinstance(CodeBlock))
+            parent_block = self.context_block
             if parent_block:
                 parent_block = parent_block.model
-            self.sw = self.find_context_top(lambda x: x.isinstance(SwitchBlock))
+            self.sw = self.context_switch
 
             ch = self.next_char()
             if self.sw:
                 logger.debug('IN a switch: %s', self.sw)
-                m1 = re.match(r'^case\s+(?P<cond>.+?)\s*:', t.content)
-                m2 = re.match(r'^default\s*:', t.content)
-                if m1 or m2:
+                if ((t.content.startswith('case') and CASE_RE.match(t.content)) or
+                        (t.content.startswith('default') and DEFAULT_RE.match(t.content))):
                     ch = ';'  # it is a goto! i.e. goto Switch Case handling code
 
             # End-Control Token #
@@ -254,10 +323,13 @@ class JavaSourceFile(SourceFile):
                 # More complex parts (class, method)
                 else:
                     push = True
+                    candidates = header_candidates(t.content)
 
-                    if not t.model:
+                    if not t.model and JavaClass in candidates:
                         t.model = JavaClass.try_parse(t.content, {u'parent_class': parent_class})
-                    if not t.model:
+                        if t.model and parent_class:
+                            parent_class.nested_classes.append(t.model)
+                    if not t.model and JavaAnonymousClass in candidates:
                         t.model = JavaAnonymousClass.try_parse(t.content, {u'parent_class': parent_class})
                         if t.model:
                             parent_function.nested_classes.append(t.model)
@@ -265,20 +337,22 @@ class JavaSourceFile(SourceFile):
                             ch = self.current_head()
                             st_content = t.content + ' { ' + self.read(cond=IsNotStatementBreaking(initial_open=1))
                             tt = Token(content=st_content)
-                            self.add_statement(tt)
+                            self.add_statement(tt, span=(first_head, self.current_head()))
                             self.finalize_token(tt)
                             # marking the statement as pre-read
                             self.statement_pre_read = self.current_head()
                             # back to the start of the AnonymousClass
                             self.rewind_to(ch)
-                    if not t.model:
+                    if not t.model and JavaSynchronizedBlock in candidates:
                         t.model = JavaSynchronizedBlock.try_parse(t.content)
                         if t.model:
-                            top = self.find_context_top(lambda x: x.isinstance(CodeBlock))
+                            top = self.context_block
                             top.model.add_statement(t.model)  # TODO: this makes problems! (because of type)
-                    if not t.model:
+                    if not t.model and JavaInterface in candidates:
                         t.model = JavaInterface.try_parse(t.content, {u'parent_class': parent_class})
-                    if not t.model:
+                        if t.model and parent_class:
+                            parent_class.nested_classes.append(t.model)
+                    if not t.model and JavaMethod in candidates:
                         t.model = JavaMethod.try_parse(t.content, {u'parent_class': parent_class})
 
                     if not t.model:
@@ -286,12 +360,15 @@ class JavaSourceFile(SourceFile):
                 # Exception
 
                 if repush:
-                    self._context.append(self._last_popped)
+                    self.context_push(self._last_popped)
                 elif push:
                     # print "pushing", t.model
                     if t.isinstance(CodeBlock):
                         t.model.starting_line = l1
-                    self._context.append(t)
+                    if self.parse_mode == ParseMode.HEADERS and t.isinstance(Function):
+                        t.model.ending_line = self.skip_block()  # the body is not parsed
+                    else:
+                        self.context_push(t)
 
             elif ch == ';':
                 t.type = 'statement'
@@ -309,21 +386,20 @@ class JavaSourceFile(SourceFile):
                 else:
                     is_special_statement = False
 
-                    PACKAGE_RE = re.compile(r'package\s+([a-zA-Z0-9_.]+)\s*;')
-                    pm = PACKAGE_RE.match(t.content)
+                    pm = t.content.startswith('package') and PACKAGE_RE.match(t.content)
 
                     # case
                     if self.sw:
                         logger.debug("IN SWITCH: %s", t.content)
 
-                        m = re.match(r'^case\s+(?P<cond>.+?)\s*:', t.content)
+                        m = t.content.startswith('case') and CASE_RE.match(t.content)
                         if m:
                             logger.debug('OPENDED case: %s', m.group('cond'))
                             self.sw.model.add_case(m.group('cond'))
                             logger.debug('SWITCH is: %s', self.sw)
                             t = None
 
-                        elif re.match(r'^default\s*:', t.content):
+                        elif t.content.startswith('default') and DEFAULT_RE.match(t.content):
                             logger.debug('SWITCH default')
                             self.sw.model.add_default()
                             logger.debug('SWITCH is: %s', self.sw)
@@ -365,7 +441,7 @@ class JavaSourceFile(SourceFile):
 
                     # normal statement
                     if t and not t.model:
-                        self.add_statement(t, is_special_statement)
+                        self.add_statement(t, is_special_statement, span=(first_head, self.current_head()))
 
                     if t and not t.model:
                         logger.error("Can not parse: %s", t.content)
@@ -382,11 +458,88 @@ class JavaSourceFile(SourceFile):
 
     def _save_model(self, token_model):
         if isinstance(token_model, JavaInterface):
-            self.interfaces.append(token_model)
+            self._interfaces.append(token_model)
         else:
             super(JavaSourceFile, self)._save_model(token_model)
 
 
+class JavaTokenStream(FileTokenizer):
+    """ Split java code to tokens without building the models, i.e. with no classes, methods or statements tree
+         kept in memory. Tokens are the same as JavaSourceFile parsing tokens: comment, control (block headers),
+         end-control and statement, in addition to label for switch cases. Model of all tokens is None.
+    """
+
+    def __init__(self, content):
+        super(JavaTokenStream, self).__init__(content)
+        self.depth = 0  # count of open blocks
+        self._switch_depths = []  # depths of the open switch blocks
+
+    @classmethod
+    def from_file(cls, filename, use_mmap=False):
+        """
+            :rtype: JavaTokenStream
+        """
+        return cls(File(filename, preload=True, use_mmap=use_mmap).file_content)
+
+    def __iter__(self):
+        while True:
+            t = self.next_token()
+            if t is None:
+                return
+            yield t
+
+    def next_token(self):
+        """ Read the next token, or return None at the end of the code
+
+            :rtype: Token
+        """
+        self.skip_spaces()
+        if not self.can_read():
+            return None
+        l1 = self.current_line()
+
+        prefix = self.read_ahead(2)
+        if prefix == '//':
+            t = Token(self.read(until='\n'), 'comment')
+        elif prefix == '/*':
+            t = Token(self.read(find='*/', beyond=2), 'comment')
+        else:
+            first_head = self.current_head()
+            content = self.read(until='{};')
+            if content.startswith('for'):
+                self.rewind_to(first_head)
+                content = self.read(cond=IsNotBreaking())
+            ch = self.next_char()
+
+            if self._switch_depths and ((content.startswith('case') and CASE_RE.match(content)) or
+                                        (content.startswith('default') and DEFAULT_RE.match(content))):
+                self.rewind_to(first_head)
+                t = Token(self.read(find=':', beyond=1), 'label')
+            elif ch == '}':
+                if content.strip():
+                    raise ParseError(u'Unexpected token: }} in "{0}".'.format(content))
+                if not self.depth:
+                    raise ParseError(u'Unmatched }.')
+                if self._switch_depths and self._switch_depths[-1] == self.depth:
+                    self._switch_depths.pop()
+                self.depth -= 1
+                t = Token('}', 'end-control')
+            elif ch == '{':
+                t = Token(content, 'control')
+                self.depth += 1
+                if content.startswith('switch(') or content.startswith('switch '):
+                    self._switch_depths.append(self.depth)
+            elif ch == ';':
+                t = Token(content + ';', 'statement')
+            else:
+                return None
+
+        t.normalize_content()
+        t.starting_line = l1
+        t.ending_line = self.current_line()
+        return t
+
+
 class JavaClass(Class, LanguageSpecificParser):
     # TODO: better detection of templates
     CLASS_RE = re.compile(r'^(\w+\s+)?class\s*(\w+)(?:\s*extends\s*([a-zA-Z0-9_.<>]+))?(?:\s+implements\s*(.+?)\s*)?$')
@@ -471,6 +624,7 @@ class JavaAnonymousClass(JavaClass):
 
 
 class JavaInterface(JavaClass):
+    kind = 'interface'
     INTERFACE_RE = re.compile(r'^(\w+\s+)?interface\s*(\w+)(?:\s+implements\s*(.+?)\s*)?$')
 
     def __init__(self, name, source_file=None, package=None, parent_class=None, access=None, implements=None):
@@ -508,6 +662,7 @@ class JavaInterface(JavaClass):
 
 
 class JavaField(Field, LanguageSpecificParser):
+    __slots__ = ()
     MATCH_RE = re.compile(r'^(@\w+\s+)?(\w+\s+)?(static\s+)?([a-zA-Z0-9<>\[\].j_]+)\s+(.*?)\s*;$', re.DOTALL)
 
     @classmethod
@@ -544,7 +699,7 @@ class JavaField(Field, LanguageSpecificParser):
 
         for n in names:
             # print "++", n
-            m = re.match(r'^(\w+)(\s*=.+)?$', n.strip(), re.DOTALL)
+            m = FIELD_NAME_RE.match(n.strip())
             # print "+++", m
             if m:
                 results.append(Field(m.group(1), tp, initializer=m.group(2), is_static=cm.group(3) is not None,
@@ -563,6 +718,7 @@ class JavaMethod(Method, LanguageSpecificParser):
     # TODO: better detection of templates
     METHOD_RE = re.compile(r'^(@[a-zA-Z0-9_]+\s+)?([a-z]+\s+)?(static\s+)?(synchronized\s+)?([a-zA-Z0-9._<>]+\s+)?(\w+)\s*\((.*?)\)(?:\s*throws ([a-zA-Z0-9<>_.,]+))?$',
                            re.DOTALL)
+    __slots__ = ('synchronized', 'annotations')
 
     def __init__(self, *args, **kwargs):
         self.synchronized = kwargs.pop(u'synchronized', None) or False
@@ -625,6 +781,7 @@ class JavaImport(Import, LanguageSpecificParser):
         see:
           * static import: http://docs.oracle.com/javase/1.5.0/docs/guide/language/static-import.html
     """
+    __slots__ = ('is_static',)
     IMPORT_RE = re.compile(r'^import\s+(static\s+)?([a-zA-Z0-9._*]+)\s*;$')
 
     def __init__(self, *args, **kwargs):
@@ -654,17 +811,26 @@ class JavaImport(Import, LanguageSpecificParser):
 
 
 class JavaStatement(Statement, LanguageSpecificParser):
+    __slots__ = ()
+
     @classmethod
     def try_parse(cls, string, opts=None):
         """
             :param str or unicode string: code to be parsed
+            :param dict opts: source_file and span (start and end offsets) of the string, so it is not copied
             :rtype: Statement
         """
         # TODO: any checks required?
+        opts = opts or {}
+        if opts.get(u'span'):
+            start, end = opts[u'span']
+            return Statement(source_file=opts[u'source_file'], start=start, end=end)
         return Statement(string)
 
 
 class ClassDefiningStatement(JavaStatement):
+    __slots__ = ()
+
     @classmethod
     def try_parse(cls, string, opts=None):
         """
@@ -676,6 +842,7 @@ class ClassDefiningStatement(JavaStatement):
 
 
 class JavaSynchronizedBlock(CodeBlock, LanguageSpecificParser):
+    __slots__ = ('locked_values',)
     SYNC_BLOCK_RE = re.compile(r'^synchronized\s*(\((?:\s|\w|[,.])+\))?\s*$')
 
     def __init__(self, locked_values=None):
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from inspector.models.base import Project, SourceFile
-from inspector.models.consts import Language
+from inspector.models.consts import Language, ParseMode
 
 
 class PythonProject(Project):
@@ -8,8 +8,8 @@ class PythonProject(Project):
 
 
 class PythonSourceFile(SourceFile):
-    def __init__(self, filename, package=None):
-        super(PythonSourceFile, self).__init__(filename, package=package)
+    def __init__(self, filename, package=None, use_mmap=False, parse_mode=ParseMode.FULL):
+        super(PythonSourceFile, self).__init__(filename, package=package, use_mmap=use_mmap, parse_mode=parse_mode)
 
     @property
     def language(self):
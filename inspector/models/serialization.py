@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+""" Compact binary format of parsed models, e.g. for the parse cache and for transferring parsed files between processes
+
+    A model file is a sequence of records, each one an encoded value (usually a SourceFile, with all of its models)
+    saved by a key, e.g. the file path. Strings (including the attribute names of the models) are interned in a
+    pool shared by all records, and ints (e.g. line numbers) are saved as varints. The records are written one by
+    one, and the pool and the index of records are written at the end, so any record can be read without reading
+    the others. Layout:
+
+        MAGIC, FORMAT_VERSION, PARSER_VERSION  (the versions are varints)
+        records
+        strings: count, then kind (0 for str, 1 for utf-8 unicode), length and bytes of each string
+        index: count, then key (a string index), offset and length of each record
+        offset of the strings section (8 bytes little-endian), MAGIC
+
+    Values are saved as a tag byte and the data of the tag, models are saved as a descriptor and the values of their
+    state (slots and __dict__, or __getstate__ if defined). The descriptor is an interned string of the class and
+    the attribute names, e.g. 'inspector.models.base:Statement _code source_file start end', so the names are saved
+    once per file. Objects, lists and dicts referenced more than once in a record (e.g. the parent_class of methods)
+    are saved once, and then referenced by their index in the record.
+"""
+import struct
+
+from inspector.parser.base import PARSER_VERSION
+
+
+MAGIC = 'SIMF'
+FORMAT_VERSION = 1
+
+# value tags
+NONE, FALSE, TRUE, INT, FLOAT, STRING, LIST, TUPLE, DICT, OBJECT, REF = range(11)
+
+# string kinds
+STR, UNICODE = 0, 1
+
+FOOTER = struct.Struct('<Q4s')
+FLOAT_STRUCT = struct.Struct('<d')
+
+# only the models (and their helpers) of this package are created when reading
+MODULE_PREFIX = 'inspector.'
+
+
+class SerializationError(ValueError):
+    pass
+
+
+##############
+#  Varints   #
+##############
+def write_varint(buf, n):
+    """ Append the unsigned int to the bytearray, 7 bits per byte
+    """
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def read_varint(data, pos):
+    """ Read an unsigned int from the bytearray, returning (value, new position)
+    """
+    b = data[pos]
+    pos += 1
+    if b < 0x80:
+        return b, pos
+    n = b & 0x7f
+    shift = 7
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def zigzag(n):
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def unzigzag(n):
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+
+#############
+#  Writing  #
+#############
+class StringPool(object):
+    def __init__(self):
+        self.strings = []
+        self._indexes = {}
+        self._descriptors = {}  # (class, attribute names) -> index
+
+    def intern_descriptor(self, cls, names):
+        key = (cls, names)
+        index = self._descriptors.get(key)
+        if index is None:
+            descriptor = ' '.join(('{0}:{1}'.format(cls.__module__, cls.__name__),) + names)
+            index = self._descriptors[key] = self.intern(descriptor)
+        return index
+
+    def intern(self, s):
+        key = (type(s), s)  # u'a' == 'a', but they must be read back with the same type
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._indexes[key] = len(self.strings)
+            self.strings.append(s)
+        return index
+
+    def encode(self):
+        buf = bytearray()
+        write_varint(buf, len(self.strings))
+        for s in self.strings:
+            if isinstance(s, unicode):
+                s = s.encode('utf-8')
+                buf.append(UNICODE)
+            else:
+                buf.append(STR)
+            write_varint(buf, len(s))
+            buf.extend(s)
+        return buf
+
+
+class _RecordEncoder(object):
+    """ Encoder of a single record, objects are referenced by their index in the record
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.buf = bytearray()
+        self._memo = {}  # id -> index
+        self._kept = []  # temporary values (e.g. states) are kept, so their ids are not reused
+
+    def encode(self, value):
+        buf = self.buf
+        t = type(value)
+        if t is str or t is unicode:
+            buf.append(STRING)
+            index = self.pool.intern(value)
+            if index < 0x80:
+                buf.append(index)
+            else:
+                write_varint(buf, index)
+        elif value is None:
+            buf.append(NONE)
+        elif t is bool:
+            buf.append(TRUE if value else FALSE)
+        elif t is int or t is long:
+            buf.append(INT)
+            if 0 <= value < 0x40:
+                buf.append(value << 1)
+            else:
+                write_varint(buf, zigzag(value))
+        elif t is float:
+            buf.append(FLOAT)
+            buf.extend(FLOAT_STRUCT.pack(value))
+        elif t is tuple:
+            buf.append(TUPLE)
+            write_varint(buf, len(value))
+            for v in value:
+                self.encode(v)
+        elif self._encode_ref(value):
+            pass
+        elif t is list:
+            buf.append(LIST)
+            write_varint(buf, len(value))
+            for v in value:
+                self.encode(v)
+        elif t is dict:
+            buf.append(DICT)
+            write_varint(buf, len(value))
+            for k, v in value.iteritems():
+                self.encode(k)
+                self.encode(v)
+        else:
+            self._encode_object(value)
+
+    def _encode_ref(self, value):
+        index = self._memo.get(id(value))
+        if index is None:
+            self._memo[id(value)] = len(self._memo)
+            return False
+        self.buf.append(REF)
+        write_varint(self.buf, index)
+        return True
+
+    def _encode_object(self, obj):
+        cls = type(obj)
+        if not cls.__module__.startswith(MODULE_PREFIX):
+            raise SerializationError('Can not serialize {0} objects'.format(cls.__name__))
+        names, values = _get_state(obj)
+        self._kept.append(values)
+        buf = self.buf
+        buf.append(OBJECT)
+        write_varint(buf, self.pool.intern_descriptor(cls, names))
+        for v in values:
+            self.encode(v)
+
+
+_slot_names_cache = {}
+
+
+def _slot_names(cls):
+    names = _slot_names_cache.get(cls)
+    if names is None:
+        names = []
+        for c in cls.__mro__:
+            slots = c.__dict__.get('__slots__', ())
+            if isinstance(slots, basestring):
+                slots = (slots,)
+            names.extend(s for s in slots if s not in ('__dict__', '__weakref__'))
+        _slot_names_cache[cls] = names
+    return names
+
+
+def _get_state(obj):
+    """ Return the attribute names and values to be saved for the object
+    """
+    if hasattr(obj, '__getstate__'):
+        state = obj.__getstate__()
+        return tuple(state), state.values()
+    names = []
+    values = []
+    for name in _slot_names(type(obj)):
+        try:
+            values.append(getattr(obj, name))
+            names.append(name)
+        except AttributeError:
+            pass  # unset slot
+    if hasattr(obj, '__dict__'):
+        names.extend(obj.__dict__)
+        values.extend(obj.__dict__.itervalues())
+    return tuple(names), values
+
+
+class ModelWriter(object):
+    """ Write models to a model file, one record at a time
+    """
+
+    def __init__(self, stream):
+        """
+            :param file stream: a binary file (or file-like object) to write to, it is not closed by the writer
+        """
+        self.stream = stream
+        self.pool = StringPool()
+        self.index = []  # (key, offset, length) of the records
+        header = bytearray(MAGIC)
+        write_varint(header, FORMAT_VERSION)
+        write_varint(header, PARSER_VERSION)
+        self.stream.write(header)
+        self._offset = len(header)
+        self.closed = False
+
+    def write(self, key, value):
+        """ Add a record to the file
+
+            :param str key: key of the record, e.g. path of the file of a SourceFile value
+            :param value: the saved value, a model or any str, int, float, bool, list, tuple or dict of them
+        """
+        encoder = _RecordEncoder(self.pool)
+        encoder.encode(value)
+        self.stream.write(encoder.buf)
+        self.index.append((self.pool.intern(key), self._offset, len(encoder.buf)))
+        self._offset += len(encoder.buf)
+
+    def close(self):
+        """ Write the strings and the index of the records, no records can be added after closing
+        """
+        if self.closed:
+            return
+        tail = self.pool.encode()
+        write_varint(tail, len(self.index))
+        for key, offset, length in self.index:
+            write_varint(tail, key)
+            write_varint(tail, offset)
+            write_varint(tail, length)
+        tail.extend(FOOTER.pack(self._offset, MAGIC))
+        self.stream.write(tail)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+#############
+#  Reading  #
+#############
+class ModelReader(object):
+    """ Random access reader of a model file, only the strings and the index are read when opening
+    """
+
+    def __init__(self, data):
+        """
+            :param data: content of a model file, a str or a memory-mapped file
+            :raise SerializationError: if the content is not a model file of the current format version
+        """
+        self.data = data
+        if len(data) < len(MAGIC) + FOOTER.size or data[:len(MAGIC)] != MAGIC:
+            raise SerializationError('Not a model file')
+        header = bytearray(data[len(MAGIC):len(MAGIC) + 20])
+        self.format_version, pos = read_varint(header, 0)
+        if self.format_version != FORMAT_VERSION:
+            raise SerializationError('Unsupported model file version: {0}'.format(self.format_version))
+        self.parser_version, _ = read_varint(header, pos)
+
+        strings_offset, magic = FOOTER.unpack(data[len(data) - FOOTER.size:])
+        if magic != MAGIC or strings_offset > len(data) - FOOTER.size:
+            raise SerializationError('Truncated model file')
+        self._descriptors = {}
+        tail = data[strings_offset:len(data) - FOOTER.size]
+        tail_bytes = bytearray(tail)
+        try:
+            self.strings, pos = self._read_strings(tail, tail_bytes)
+            count, pos = read_varint(tail_bytes, pos)
+            self.index = {}
+            for _ in xrange(count):
+                key, pos = read_varint(tail_bytes, pos)
+                offset, pos = read_varint(tail_bytes, pos)
+                length, pos = read_varint(tail_bytes, pos)
+                self.index[self.strings[key]] = (offset, length)
+        except IndexError:
+            raise SerializationError('Truncated model file')
+
+    @staticmethod
+    def _read_strings(tail, tail_bytes):
+        count, pos = read_varint(tail_bytes, 0)
+        strings = []
+        for _ in xrange(count):
+            kind = tail_bytes[pos]
+            length, pos = read_varint(tail_bytes, pos + 1)
+            s = tail[pos:pos + length]
+            if len(s) != length:
+                raise IndexError()
+            strings.append(s.decode('utf-8') if kind == UNICODE else s)
+            pos += length
+        return strings, pos
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def read(self, key):
+        """ Decode the record saved by the given key
+
+            :raise KeyError: if there is no such record
+        """
+        offset, length = self.index[key]
+        decoder = _RecordDecoder(self.strings, self._descriptors, bytearray(self.data[offset:offset + length]))
+        try:
+            return decoder.decode()
+        except IndexError:
+            raise SerializationError('Truncated record: {0}'.format(key))
+
+    def iteritems(self):
+        for key in self.index:
+            yield key, self.read(key)
+
+
+_classes_cache = {}
+
+
+def _resolve_descriptor(descriptor):
+    """ Return the class and the attribute names of an object descriptor
+    """
+    p = descriptor.split(' ')
+    return _resolve_class(p[0]), p[1:]
+
+
+def _resolve_class(name):
+    cls = _classes_cache.get(name)
+    if cls is None:
+        module_name, _, class_name = name.partition(':')
+        if not module_name.startswith(MODULE_PREFIX):
+            raise SerializationError('Can not deserialize {0} objects'.format(name))
+        try:
+            module = __import__(module_name, fromlist=[class_name])
+            cls = getattr(module, class_name)
+        except (ImportError, AttributeError):
+            raise SerializationError('Unknown model class: {0}'.format(name))
+        _classes_cache[name] = cls
+    return cls
+
+
+class _RecordDecoder(object):
+    def __init__(self, strings, descriptors, data):
+        self.strings = strings
+        self.descriptors = descriptors  # string index -> (class, attribute names), shared by the records
+        self.data = data
+        self.pos = 0
+        self._memo = []
+
+    def decode(self):
+        data = self.data
+        pos = self.pos
+        tag = data[pos]
+        if tag == STRING:
+            index = data[pos + 1]
+            if index < 0x80:
+                self.pos = pos + 2
+            else:
+                index, self.pos = read_varint(data, pos + 1)
+            return self.strings[index]
+        self.pos += 1
+        if tag == INT:
+            n, self.pos = read_varint(data, self.pos)
+            return unzigzag(n)
+        if tag == NONE:
+            return None
+        if tag == FALSE:
+            return False
+        if tag == TRUE:
+            return True
+        if tag == REF:
+            index, self.pos = read_varint(data, self.pos)
+            return self._memo[index]
+        if tag == OBJECT:
+            return self._decode_object()
+        if tag == LIST:
+            value = []
+            self._memo.append(value)
+            count, self.pos = read_varint(data, self.pos)
+            for _ in xrange(count):
+                value.append(self.decode())
+            return value
+        if tag == TUPLE:
+            count, self.pos = read_varint(data, self.pos)
+            return tuple([self.decode() for _ in xrange(count)])
+        if tag == DICT:
+            value = {}
+            self._memo.append(value)
+            count, self.pos = read_varint(data, self.pos)
+            for _ in xrange(count):
+                k = self.decode()
+                value[k] = self.decode()
+            return value
+        if tag == FLOAT:
+            value = FLOAT_STRUCT.unpack(str(data[self.pos:self.pos + FLOAT_STRUCT.size]))[0]
+            self.pos += FLOAT_STRUCT.size
+            return value
+        raise SerializationError('Invalid value tag: {0}'.format(tag))
+
+    def _decode_object(self):
+        index, self.pos = read_varint(self.data, self.pos)
+        descriptor = self.descriptors.get(index)
+        if descriptor is None:
+            descriptor = self.descriptors[index] = _resolve_descriptor(self.strings[index])
+        cls, names = descriptor
+        obj = cls.__new__(cls)
+        self._memo.append(obj)
+        decode = self.decode
+        for name in names:
+            setattr(obj, name, decode())
+        return obj
+
+
+###############
+#  Shortcuts  #
+###############
+class _Buffer(object):
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s):
+        self.chunks.append(str(s))
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+def dumps(value):
+    """ Return a model file containing just the value (saved by the key ''), e.g. for sending it to another process
+    """
+    buf = _Buffer()
+    with ModelWriter(buf) as writer:
+        writer.write('', value)
+    return buf.getvalue()
+
+
+def loads(data):
+    """ Return the value saved by dumps
+    """
+    return ModelReader(data).read('')
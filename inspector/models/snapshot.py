@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+import mmap
+
+from inspector.models.serialization import ModelReader, ModelWriter
+from inspector.parser.base import PARSER_VERSION
+from inspector.utils.files import same_stat
+
+
+class ProjectSnapshot(object):
+    """ Parsed models of all source files of a project, saved in a model file (see inspector.models.serialization)
+         that is memory-mapped when opened, so files are read from it on demand instead of being parsed
+
+        Each parsed source file is saved in its own record (by its relative path), and an index record keeps
+        the (mtime, size) of the files and the paths of the symbols defined in them. A file whose size or
+        modification time is changed since the snapshot was saved is not read from the snapshot.
+    """
+    INDEX_KEY = '/index'  # relative paths never start with /
+
+    def __init__(self, filename):
+        """
+            :param str filename: the snapshot file, saved by ProjectSnapshot.save
+            :raise inspector.models.serialization.SerializationError: if the file is not a valid snapshot
+        """
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.reader = ModelReader(self._data)
+            index = self.reader.read(self.INDEX_KEY)
+        except:
+            self.close()
+            raise
+        self.parser_version = self.reader.parser_version
+        self.tag = index['tag']
+        self.files_stat = index['files']
+        self._symbol_paths = dict(((kind, qualified_name), path) for kind, qualified_name, path in index['symbols'])
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+    @property
+    def is_current(self):
+        """ Whether the snapshot is saved by this parser version, older snapshots must not be used
+        """
+        return self.parser_version == PARSER_VERSION
+
+    def get_file(self, rel_path, stat):
+        """ Return the saved model of the file, or None if it is not saved or the file has changed
+
+            :param str rel_path: relative path of the file in the project
+            :param tuple stat: current (mtime, size) of the file
+            :rtype: inspector.models.base.SourceFile or None
+        """
+        saved_stat = self.files_stat.get(rel_path)
+        if saved_stat is None or not same_stat(saved_stat, stat) or rel_path not in self.reader:
+            return None
+        return self.reader.read(rel_path)
+
+    def symbol_path(self, kind, qualified_name):
+        """ Return relative path of the file defining the symbol, or None if it is not in the snapshot
+        """
+        return self._symbol_paths.get((kind, qualified_name))
+
+    @classmethod
+    def save(cls, project, filename, workers=None):
+        """ Parse all files of the project and save the parsed source files in a snapshot
+             note: the files that can not be parsed are not saved, see Project.parse_all
+
+            :type project: inspector.models.base.Project
+            :param str filename: the snapshot file, replaced if exists
+            :return: failures of the files that could not be loaded
+            :rtype: list of inspector.models.exceptions.ParseFailure
+        """
+        failures = project.parse_all(workers=workers)
+        files_stat = {}
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            writer = ModelWriter(f)
+            for path in sorted(project.files):
+                sf = project.files[path]
+                if sf is not None and getattr(sf, 'parsed', False):
+                    writer.write(path, sf)
+                    files_stat[path] = project._files_stat[path]
+            symbols = [(s.kind, s.qualified_name, s.path) for s in project.symbols]
+            writer.write(cls.INDEX_KEY, {'tag': project._cache_tag, 'files': files_stat, 'symbols': symbols})
+            writer.close()
+        os.rename(tmp_filename, filename)  # readers never see half written snapshots
+        return failures
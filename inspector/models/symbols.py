@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+
+# a named code object of a project, located by its file (relative path) and lines
+Symbol = namedtuple('Symbol', ['kind', 'qualified_name', 'model', 'path', 'starting_line', 'ending_line'])
+
+
+def class_methods(cls):
+    """ Return the methods of the class, including the abstract methods of interfaces
+    """
+    return cls.methods + getattr(cls, 'abstract_methods', [])
+
+
+def walk_classes(source_file):
+    """ Yield (class, qualified name, parent class, enclosing method) of all classes of a parsed source file,
+         each class before its nested classes
+
+        Nested classes are named after their parent class (a.b.Outer.Inner), and anonymous classes get the Java
+        binary name style numbering in their enclosing class (a.b.Outer$1). The parent and the method are None
+        for the top-level classes, and the method is None for the classes not defined in a method.
+
+        :type source_file: inspector.models.base.SourceFile
+    """
+    for cls in source_file.classes + getattr(source_file, 'interfaces', []):
+        for item in _walk_class(cls, cls.qualified_name, None, None):
+            yield item
+
+
+def _walk_class(cls, qualified_name, parent, method):
+    yield cls, qualified_name, parent, method
+    anonymous_count = 0
+    for m in class_methods(cls):
+        for nested in m.nested_classes:
+            if nested.name:
+                nested_name = qualified_name + '.' + nested.name
+            else:
+                anonymous_count += 1
+                nested_name = '{0}${1}'.format(qualified_name, anonymous_count)
+            for item in _walk_class(nested, nested_name, cls, m):
+                yield item
+    for nested in cls.nested_classes:
+        for item in _walk_class(nested, qualified_name + '.' + nested.name, cls, None):
+            yield item
+
+
+class SymbolIndex(object):
+    """ Project-wide table of classes, interfaces, methods and fields, by their qualified names
+         (classes are named like walk_classes does)
+    """
+    KINDS = ('class', 'interface', 'method', 'field')
+
+    def __init__(self):
+        self._symbols = {}  # (kind, qualified_name) -> Symbol
+        self._shadowed = {}  # (kind, qualified_name) -> Symbols of the same name in other files, used if it is removed
+        self._file_keys = {}  # path -> keys of symbols defined in the file
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def __iter__(self):
+        return self._symbols.itervalues()
+
+    def get(self, kind, qualified_name):
+        """ Return the symbol, or None if it is not indexed
+             note: the file name part can be repeated for classes named after their file (a.b.X.X for a.b.X)
+
+            :rtype: Symbol or None
+        """
+        symbol = self._symbols.get((kind, qualified_name))
+        if symbol is None:
+            p = qualified_name.split('.')
+            for i in range(len(p) - 1):
+                if p[i] == p[i + 1]:
+                    return self._symbols.get((kind, '.'.join(p[:i] + p[i + 1:])))
+        return symbol
+
+    def add_file(self, path, source_file):
+        """ Index all symbols of a parsed source file, replacing its previous symbols
+
+            :param str path: relative path of the file in the project
+            :type source_file: inspector.models.base.SourceFile
+        """
+        self.remove_file(path)
+        keys = self._file_keys[path] = []
+        for cls, qualified_name, _, _ in walk_classes(source_file):
+            self._add(path, keys, cls.kind, qualified_name, cls)
+            for f in cls.fields:
+                self._add(path, keys, 'field', qualified_name + '.' + f.name, f)
+            for m in class_methods(cls):
+                self._add(path, keys, 'method', qualified_name + '.' + m.name, m)
+
+    def remove_file(self, path):
+        for key in self._file_keys.pop(path, []):
+            shadowed = self._shadowed.pop(key, [])
+            if self._symbols[key].path == path:
+                if shadowed:
+                    self._symbols[key] = shadowed.pop(0)  # still defined by another file
+                else:
+                    del self._symbols[key]
+            else:
+                shadowed = [s for s in shadowed if s.path != path]
+            if shadowed:
+                self._shadowed[key] = shadowed
+
+    def _add(self, path, keys, kind, qualified_name, model):
+        key = (kind, qualified_name)
+        symbol = Symbol(kind, qualified_name, model, path, getattr(model, 'starting_line', None),
+                        getattr(model, 'ending_line', None))
+        indexed = self._symbols.get(key)
+        if indexed is None:
+            self._symbols[key] = symbol
+        elif indexed.path == path or any(s.path == path for s in self._shadowed.get(key, [])):
+            return  # e.g. overloaded methods, the first one is indexed like Class.get_method does
+        else:
+            # defined by another file too, the first indexed one is used while it is not removed
+            self._shadowed.setdefault(key, []).append(symbol)
+        keys.append(key)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from array import array
+from collections import OrderedDict
+
+from inspector.models.symbols import class_methods, walk_classes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+NONE = -1  # the value of missing references (e.g. the parent of top-level classes) and strings
+
+
+class StringPool(object):
+    """ Interned strings of model tables, the tables keep indexes of the strings in the pool
+    """
+
+    def __init__(self):
+        self.strings = []
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, index):
+        return self.strings[index] if index != NONE else None
+
+    def intern(self, s):
+        """ Return index of the string in the pool, adding it if needed (NONE for None)
+        """
+        if s is None:
+            return NONE
+        index = self._indexes.get(s)
+        if index is None:
+            index = self._indexes[s] = len(self.strings)
+            self.strings.append(s)
+        return index
+
+
+class Table(object):
+    """ Rows of a model type stored in columns, each column is an array of the same length
+    """
+
+    def __init__(self, name, columns):
+        """
+            :param str name: name of the table, e.g. 'methods'
+            :param list of (str, str) columns: names and array type codes of the columns
+        """
+        self.name = name
+        self.columns = OrderedDict((c, array(type_code)) for c, type_code in columns)
+
+    def __len__(self):
+        return len(next(self.columns.itervalues()))
+
+    def __getitem__(self, column):
+        """
+            :rtype: array.array
+        """
+        return self.columns[column]
+
+    def append(self, *values):
+        """ Add a row, returning its index
+        """
+        for column, value in zip(self.columns.itervalues(), values):
+            column.append(value)
+        return len(self) - 1
+
+    def row(self, index):
+        return OrderedDict((c, values[index]) for c, values in self.columns.iteritems())
+
+    def to_numpy(self):
+        """ Return the columns as numpy arrays (without copying the data)
+
+            :rtype: dict[str, numpy.ndarray]
+        """
+        if numpy is None:
+            raise ImportError('numpy is required for converting tables to numpy arrays')
+        return dict((c, numpy.frombuffer(values, dtype=values.typecode)) for c, values in self.columns.iteritems())
+
+
+class ModelTables(object):
+    """ Columnar export of parsed source files, for bulk analysis of many files, e.g. with numpy
+
+        Each model type has a table, rows reference their parents by row index in the parent table
+        (NONE for no parent), and strings are indexes in the shared string pool. Classes include the
+        interfaces, and the nested and anonymous classes (named like the symbol index does, e.g. a.b.X$1).
+    """
+
+    def __init__(self):
+        self.strings = StringPool()
+        self.files = Table('files', [('path', 'i'), ('package', 'i'), ('lines', 'i')])
+        self.classes = Table('classes', [('file', 'i'), ('parent', 'i'), ('method', 'i'), ('name', 'i'),
+                                         ('qualified_name', 'i'), ('kind', 'i'), ('access', 'b'),
+                                         ('starting_line', 'i'), ('ending_line', 'i')])
+        self.methods = Table('methods', [('file', 'i'), ('class', 'i'), ('name', 'i'), ('return_type', 'i'),
+                                         ('access', 'b'), ('binding', 'b'), ('abstract', 'b'), ('arguments', 'i'),
+                                         ('starting_line', 'i'), ('ending_line', 'i')])
+        self.fields = Table('fields', [('file', 'i'), ('class', 'i'), ('name', 'i'), ('type', 'i'),
+                                       ('visibility', 'b'), ('is_static', 'b')])
+        self.imports = Table('imports', [('file', 'i'), ('import_str', 'i'), ('is_static', 'b')])
+        self.statements = Table('statements', [('file', 'i'), ('method', 'i'), ('start', 'i'), ('end', 'i'),
+                                               ('starting_line', 'i'), ('ending_line', 'i')])
+
+    @property
+    def tables(self):
+        return [self.files, self.classes, self.methods, self.fields, self.imports, self.statements]
+
+    def add_file(self, path, source_file):
+        """ Add the models of a parsed source file
+
+            :param str path: relative path of the file in the project
+            :type source_file: inspector.models.base.SourceFile
+        """
+        s = self.strings.intern
+        package = source_file.package if isinstance(source_file.package, basestring) else None
+        file_row = self.files.append(s(path), s(package), source_file.lines_count)
+        for im in source_file.imports:
+            self.imports.append(file_row, s(im.import_str), getattr(im, 'is_static', False))
+        line_index = source_file.line_index
+        rows = {}  # id of the added classes and methods -> row, for the references of their nested classes
+        for cls, qualified_name, parent, method in walk_classes(source_file):
+            class_row = rows[id(cls)] = self.classes.append(
+                file_row, rows[id(parent)] if parent is not None else NONE,
+                rows[id(method)] if method is not None else NONE, s(cls.name), s(qualified_name), s(cls.kind),
+                getattr(cls, 'access', NONE), _line(cls.starting_line), _line(cls.ending_line))
+            for f in cls.fields:
+                visibility = f.visibility if isinstance(f.visibility, int) else NONE
+                self.fields.append(file_row, class_row, s(f.name), s(f.type), visibility, f.is_static)
+            for m in class_methods(cls):
+                row = rows[id(m)] = self.methods.append(
+                    file_row, class_row, s(m.name), s(m.return_type), m.access, m.binding, m.abstract,
+                    len(m.arguments), _line(m.starting_line), _line(m.ending_line))
+                for st in m.statements:
+                    if getattr(st, 'start', None) is not None:
+                        self.statements.append(file_row, row, st.start, st.end, line_index.line_at(st.start),
+                                               line_index.line_at(st.end - 1))
+
+    ################
+    #  Aggregates  #
+    ################
+    def count_by(self, table, column, size=None):
+        """ Count the rows of the table by the values of an int column, e.g. methods per class by the class column,
+             rows with NONE values are not counted
+
+            :param Table table: the table to be counted, e.g. self.methods
+            :param str column: the column to be grouped by
+            :param int or None size: length of the result, e.g. len(self.classes), defaults to the max value + 1
+            :return: counts, indexed by the column value
+        """
+        values = table[column]
+        if size is None:
+            size = max(values) + 1 if values else 0
+        if numpy is not None:
+            values = numpy.frombuffer(values, dtype=values.typecode)
+            return numpy.bincount(values[values != NONE], minlength=size)[:size]
+        counts = array('i', [0] * size)
+        for v in values:
+            if v != NONE and v < size:
+                counts[v] += 1
+        return counts
+
+    def lines_counts(self, table):
+        """ Return the lines count of each row of a table with line spans, e.g. LOC of self.methods
+             (NONE for the rows with unknown lines)
+        """
+        starts, ends = table['starting_line'], table['ending_line']
+        if numpy is not None:
+            starts = numpy.frombuffer(starts, dtype=starts.typecode)
+            ends = numpy.frombuffer(ends, dtype=ends.typecode)
+            return numpy.where((starts != NONE) & (ends != NONE), ends - starts + 1, NONE)
+        return array('i', [e - b + 1 if b != NONE and e != NONE else NONE for b, e in zip(starts, ends)])
+
+
+def _line(line):
+    return line if line is not None else NONE
@@ -2,11 +2,20 @@
 from inspector.utils.strings import quoted
 
 
+# version of the parsing results, must be increased whenever the parsers or the models change,
+#  so results saved by older versions (e.g. in a ParseCache) are not used anymore
+PARSER_VERSION = 6
+
+
 class Token(object):
-    def __init__(self, content=None, t_type=None, model=None):
+    __slots__ = ('content', 'type', 'model', 'starting_line', 'ending_line')
+
+    def __init__(self, content=None, t_type=None, model=None, starting_line=None, ending_line=None):
         self.content = content
         self.type = t_type
         self.model = model
+        self.starting_line = starting_line  # line span of the token, set by token streams
+        self.ending_line = ending_line
 
     def normalize_content(self):
         if self.content:
@@ -23,6 +32,8 @@ class Token(object):
 
 
 class LanguageSpecificParser(object):
+    __slots__ = ()
+
     @classmethod
     def try_parse(cls, string, opts=None):
         """
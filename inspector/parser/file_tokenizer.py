@@ -1,4 +1,56 @@
 # -*- coding: utf-8 -*-
+import re
+import mmap
+
+from inspector.utils.lines import LineIndex
+
+
+class ScanCondition(object):
+    """ A read(cond=...) condition that can find its stopping point without a call per char
+
+        Subclasses define the per char __call__ (which may be stateful), and set stop_re to
+        a regex matching every char that may change the state or be rejected; scan() then
+        jumps between those chars only.
+    """
+    stop_re = None
+
+    def __call__(self, ch):
+        raise NotImplementedError
+
+    def scan(self, content, start, end):
+        """ Return index of the first char in content[start:end] rejected by this condition,
+             or end if all chars are accepted
+        """
+        if self.stop_re is None:
+            i = start
+            while i < end and self(content[i]):
+                i += 1
+            return i
+
+        pos = start
+        while True:
+            m = self.stop_re.search(content, pos, end)
+            if m is None:
+                return end
+            if not self(m.group()):
+                return m.start()
+            pos = m.end()
+
+
+class StopAt(ScanCondition):
+    """ Accept all chars except the given stop chars, e.g. StopAt('{};')
+    """
+    _patterns = {}
+
+    def __init__(self, chars):
+        self.chars = chars
+        stop_re = self._patterns.get(chars)
+        if stop_re is None:
+            stop_re = self._patterns[chars] = re.compile('[' + re.escape(chars) + ']')
+        self.stop_re = stop_re
+
+    def __call__(self, ch):
+        return ch not in self.chars
 
 
 class FileTokenizer(object):
@@ -12,12 +64,12 @@ class FileTokenizer(object):
     def set_content(self, content_file):
         # resetting heads
         self._parse_head = 0
-        self._cur_line = 1
+        self._line_index = None
 
         # loading content from file
         if content_file is not None:
-            if isinstance(content_file, basestring):
-                self.file_content = content_file
+            if isinstance(content_file, basestring) or isinstance(content_file, mmap.mmap):
+                self.file_content = content_file  # mapped content is scanned in place, without copying
             elif isinstance(content_file, file):
                 self.file_content = content_file.read()
             else:
@@ -33,29 +85,43 @@ class FileTokenizer(object):
     def can_read(self):
         return self._parse_head < self.L
 
+    @property
+    def line_index(self):
+        """ Newline offsets of the content, built on first use
+
+            :rtype: LineIndex
+        """
+        if self._line_index is None:
+            self._line_index = LineIndex(self.file_content or '')
+        return self._line_index
+
+    def current_line(self):
+        """ Return the line number of the current head location
+        """
+        return self.line_index.line_at(self._parse_head)
+
     def next_char(self, skip=0):
-        # TODO: optimize for skip > 0
         if skip < 0:
             raise ValueError('skip can not be negative')
-        for _ in range(skip + 1):
-            if not self.can_read():
-                return None
-            if self.file_content[self._parse_head] == '\n':
-                self._cur_line += 1
-            self._parse_head += 1
-        return self.file_content[self._parse_head - 1]
+        head = self._parse_head + skip + 1
+        if head > self.L:
+            self._parse_head = self.L
+            return None
+        self._parse_head = head
+        return self.file_content[head - 1]
 
     def skip_spaces(self):
         while self.can_read() and self.read_ahead_char().isspace():
             self.next_char()
 
-    def read(self, length=None, to=None, cond=None, find=None, beyond=0):
+    def read(self, length=None, to=None, cond=None, find=None, until=None, beyond=0):
         """ Read and return a number of chars from current head location
 
             :param int length: count of chars to be read
             :param int to: index in file to read char up to it
             :param cond: all consecutive chars with cond(ch)==True will be read
             :param find: substring to read up to it
+            :param str until: stop chars, all consecutive chars not in this string will be read
             :param int beyond: this number of additional char will read and added to the result, defaults to 0
             :rtype: str
         """
@@ -66,16 +132,30 @@ class FileTokenizer(object):
         elif to is not None:
             return self.read(length=to - self._parse_head, beyond=beyond)
         elif cond is not None:
-            s = ''
-            while self.can_read() and cond(self.file_content[self._parse_head]):
-                s += self.next_char()
+            start = self._parse_head
+            if isinstance(cond, ScanCondition):
+                stop = cond.scan(self.file_content, start, self.L)
+            else:
+                stop = start
+                while stop < self.L and cond(self.file_content[stop]):
+                    stop += 1
+            s = self._advance_to(stop)
             for _ in range(beyond):
                 s += self.next_char()
             return s
         elif find is not None:
             return self.read(to=self.find_ahead(find), beyond=beyond)
+        elif until is not None:
+            return self.read(cond=StopAt(until), beyond=beyond)
         raise ValueError
 
+    def _advance_to(self, head_location):
+        """ Move the head forward to the given location, returning the chars passed over
+        """
+        start = self._parse_head
+        self._parse_head = head_location
+        return self.file_content[start:head_location]
+
     def read_ahead(self, length):
         return self.file_content[self._parse_head:self._parse_head + length]
 
@@ -89,4 +169,6 @@ class FileTokenizer(object):
         return self._parse_head
 
     def rewind_to(self, head_location):
+        """ Move the head to the given location, backward or forward (without reading the chars passed over)
+        """
         self._parse_head = head_location
@@ -9,14 +9,26 @@ from inspector.saql.sams import SAMS
 
 
 if __name__ == '__main__':
-    sams = SAMS()
+    try:
+        ind = sys.argv.index('-c')
+    except ValueError:
+        sams = SAMS()  # no cache directory specified
+    else:
+        sams = SAMS(cache_dir=sys.argv[ind + 1])
+
+    try:
+        ind = sys.argv.index('-s')
+    except ValueError:
+        snapshot_path = None  # the project is parsed on demand
+    else:
+        snapshot_path = sys.argv[ind + 1]
 
     try:
         ind = sys.argv.index('-d')
     except ValueError:
         pass  # no database specified
     else:
-        sams.open_project(sys.argv[ind + 1])
+        sams.open_project(sys.argv[ind + 1], snapshot_path=snapshot_path)
 
     while True:
         try:
@@ -32,12 +44,20 @@ if __name__ == '__main__':
 
         try:
             start_time = time.time()
-            result = sams.run(qs)
+            count = 0
+            # results are printed as soon as they are found
+            for result in sams.stream(qs):
+                if isinstance(result, basestring):
+                    print(result)  # messages and query plans
+                elif result is not None:
+                    print(repr(result))
+                    count += 1
             d = time.time() - start_time
         except ValueError as e:
             print('ERROR: {0}'.format(e.message))
         else:
-            if result is not None:
-                print(result)
-            print('{0:.1f}ms'.format(d * 1000))
+            if count:
+                print('{0} results, {1:.1f}ms'.format(count, d * 1000))
+            else:
+                print('{0:.1f}ms'.format(d * 1000))
     print('bye!')
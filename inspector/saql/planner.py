@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import re
+from collections import defaultdict
+from itertools import islice
+
+from inspector.models.base import Class
+
+
+CONDITION_RE = re.compile(r'^\s*(\w+)\s*\((.*?)\)\s*$')
+
+
+class Predicate(object):
+    """ A WHERE condition of a query, i.e. a function of the selected objects
+    """
+
+    def __init__(self, condition, name, fn, params):
+        """
+            :param str condition: the condition as it is in the query, e.g. "nameIs('Foo')"
+            :param str name: function name, e.g. 'nameIs'
+            :param fn: the function, called with each object and the params
+            :param list params: the parsed parameters
+        """
+        self.condition = condition
+        self.name = name
+        self.fn = fn
+        self.params = params
+        self.selectivity = 1.  # estimated ratio of the objects passing this predicate
+
+    def __call__(self, obj):
+        return self.fn(obj, *self.params)
+
+    def __unicode__(self):
+        return self.condition
+
+    def __str__(self):
+        return str(unicode(self))
+
+
+class ProjectIndexes(object):
+    """ Name and inheritance indexes of the classes and methods selected FROM project, i.e. the classes of all
+         files and their methods, in the same order as they are scanned
+
+        Building the indexes loads (and parses) all files of the project, so they are built on the first query
+         that uses them, and are kept until the project files change (see Project.generation).
+    """
+
+    def __init__(self, project):
+        """
+            :type project: inspector.models.base.Project
+        """
+        self.project = project
+        project.files  # scanning the files if not scanned yet, before keeping the generation
+        self.generation = project.generation
+        self.classes = []
+        self.methods = []
+        self.class_names = defaultdict(list)
+        self.class_parents = defaultdict(list)
+        self.method_names = defaultdict(list)
+        for f in project.all_files():
+            for cls in f.classes:
+                self.classes.append(cls)
+                self.class_names[cls.name].append(cls)
+                for parent in cls.extends:
+                    self.class_parents[parent].append(cls)
+                for m in cls.methods:
+                    self.methods.append(m)
+                    self.method_names[m.name].append(m)
+
+    def lookup(self, index_name, key):
+        """
+            :param str index_name: e.g. 'class_names'
+            :rtype: list
+        """
+        return getattr(self, index_name).get(key, [])
+
+
+class QueryPlan(object):
+    """ How a query is run: the access path giving the candidates (a scan of the FROM clause or an index
+         lookup), and the remaining predicates, in the order they are evaluated
+
+        Plans are compiled once and reused while the project files are not changed, so the candidates are
+         kept after the first execution that iterates all of them (i.e. is not stopped by LIMIT).
+    """
+
+    def __init__(self, query, access_path, candidates, predicates):
+        """
+            :param inspector.saql.saql_parser.SaqlQuery query: the planned query
+            :param str access_path: description of how the candidates are found
+            :param candidates: a function returning the candidate objects
+            :param list of Predicate predicates: the predicates, evaluated in this order for each candidate
+        """
+        self.query = query
+        self.access_path = access_path
+        self.candidates = candidates
+        self.predicates = predicates
+        self._candidates = None  # the materialized candidates, after the first complete execution
+
+    def execute(self):
+        """
+            :return: the selected objects
+            :rtype: list
+        """
+        return list(self.iter_results())
+
+    def iter_results(self):
+        """ Return an iterator of the selected objects, candidates are found (and files are parsed) only as
+             far as the results are consumed, or up to the LIMIT of the query
+        """
+        results = self._iter_matches()
+        if self.query.limit is not None:
+            results = islice(results, self.query.limit)
+        return results
+
+    def _iter_matches(self):
+        predicates = self.predicates
+        for o in self._iter_candidates():
+            # all() stops at the first predicate an object does not pass
+            if all(p(o) for p in predicates):
+                yield o
+
+    def _iter_candidates(self):
+        if self._candidates is not None:
+            for o in self._candidates:
+                yield o
+            return
+        candidates = []
+        for o in self.candidates():
+            candidates.append(o)
+            yield o
+        self._candidates = candidates  # not reached if the iteration is stopped
+
+    def explain(self):
+        lines = [u'{0}'.format(unicode(self.query)), u'  1. {0}'.format(self.access_path)]
+        for p in self.predicates:
+            lines.append(u'  {0}. filter: {1} (selectivity: {2:.2f})'.format(len(lines), p, p.selectivity))
+        if self.query.limit is not None:
+            lines.append(u'  {0}. limit: {1}'.format(len(lines), self.query.limit))
+        return u'\n'.join(lines)
+
+
+class QueryPlanner(object):
+    """ Planner of SAQL select queries, WHERE predicates over all project classes or methods are looked up in
+         the ProjectIndexes when possible, and the others are ordered by their estimated selectivity
+    """
+    # (object type, function) -> index answering the predicate
+    INDEXED = {
+        ('class', 'nameIs'): 'class_names',
+        ('class', 'isSubclassOf'): 'class_parents',
+        ('method', 'nameIs'): 'method_names',
+    }
+    # estimated selectivity of the functions, for the predicates not answered by the indexes
+    SELECTIVITY = {
+        'nameIs': 0.01,
+        'isSubclassOf': 0.05,
+        'isAbstract': 0.1,
+        'isProtected': 0.1,
+        'nameIsLike': 0.2,
+        'isPrivate': 0.2,
+        'isPackage': 0.2,
+        'isPublic': 0.5,
+    }
+
+    def __init__(self, sams):
+        """
+            :type sams: inspector.saql.sams.SAMS
+        """
+        self.sams = sams
+        self._indexes = None
+
+    def project_indexes(self):
+        """ Return the indexes of the project, (re)building them if the project files are changed
+
+            :rtype: ProjectIndexes
+        """
+        project = self.sams.project
+        if self._indexes is None or self._indexes.project is not project or \
+                self._indexes.generation != project.generation:
+            self._indexes = ProjectIndexes(project)
+        return self._indexes
+
+    def parse_predicate(self, condition, object_type):
+        """
+            :param str condition: a WHERE condition, e.g. "nameIs('Foo')"
+            :param str object_type: type of the selected objects, e.g. 'class'
+            :rtype: Predicate
+        """
+        # TODO: support operators on functions too
+        m = CONDITION_RE.match(condition)
+        if not m:
+            raise ValueError('Invalid WHERE condition: {0}'.format(condition))
+        fn_name = m.group(1)
+        try:
+            fn = self.sams.QUERY_DEF['FUNCTIONS'][object_type][fn_name]
+        except KeyError:
+            raise ValueError('Invalid function for {1} object: {0}'.format(fn_name, object_type))
+        params = [self.sams.parse_token(s) for s in m.group(2).split(',')] if m.group(2) else []
+        predicate = Predicate(condition, fn_name, fn, params)
+        predicate.selectivity = self.SELECTIVITY.get(fn_name, 1.)
+        return predicate
+
+    @staticmethod
+    def index_key(predicate):
+        """ Return the key of the predicate in its index, or None if the predicate can not be looked up
+             note: the lookup must give the same objects as evaluating the predicate on a scan
+        """
+        key = predicate.params[0] if len(predicate.params) == 1 else None
+        if predicate.name == 'isSubclassOf' and isinstance(key, Class):
+            key = key.name  # like Class.is_subclass_of
+        return key if isinstance(key, basestring) else None
+
+    def plan(self, query, object_type):
+        """
+            :param inspector.saql.saql_parser.SaqlQuery query: a select query
+            :param str object_type: type of the selected objects, 'class', 'method', 'line' or 'instance'
+            :rtype: QueryPlan
+        """
+        predicates = [self.parse_predicate(c, object_type) for c in query.where_conditions]
+
+        if object_type == 'class':
+            candidates = lambda: self.sams.select_candidate_classes(query)
+        elif object_type == 'method':
+            candidates = lambda: self.sams.select_candidate_methods(query)
+        else:
+            candidates = lambda: []  # TODO: selecting lines and instances
+        access_path = u'scan: {0} FROM {1}'.format(query.select_type, u', '.join(query.select_from))
+
+        if query.is_project_level():
+            indexed = [p for p in predicates
+                       if (object_type, p.name) in self.INDEXED and self.index_key(p) is not None]
+            if indexed:
+                indexes = self.project_indexes()
+                universe = len(indexes.classes if object_type == 'class' else indexes.methods)
+                for p in indexed:
+                    p.selectivity = 1. * len(indexes.lookup(self.INDEXED[(object_type, p.name)],
+                                                            self.index_key(p))) / max(universe, 1)
+                best = min(indexed, key=lambda p: p.selectivity)
+                predicates.remove(best)
+                index_name = self.INDEXED[(object_type, best.name)]
+                rows = indexes.lookup(index_name, self.index_key(best))
+                candidates = lambda: rows
+                access_path = u'index lookup: {0}[{1!r}] ({2} of {3} {4})'.format(
+                    index_name, self.index_key(best), len(rows), universe, query.select_type)
+
+        predicates.sort(key=lambda p: p.selectivity)  # stable, so equal ones are evaluated in the query order
+        return QueryPlan(query, access_path, candidates, predicates)
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+""" Wire formats of the SAQL results, sent by saqld
+
+    A response is the results of a request, sent in chunks as they are found (a chunk is sent when it has
+    CHUNK_SIZE results, or FLUSH_INTERVAL seconds after its first result, even if the query is still looking
+    for the next one), then an error if the request failed, and then the end of the response. The results are
+    models (classes and methods) or texts (e.g. the messages of the actions, or the lines of EXPLAIN), encoded
+    in one of the formats:
+
+    text: a line for each result (the repr of models), the errors are 'ERROR: message' lines, and the response
+        ends with an empty line.
+
+    json: a JSON object for each result on its own line, e.g.
+        {"end_line":128,"file":"src/a/b/C.java","kind":"method","name":"a.b.C.foo","start_line":120}
+        or {"kind":"text","text":"..."}, the errors are {"error":"..."} lines, and the response ends with a
+        {"count":<number of results>,"end":true} line.
+
+    binary: frames, each a type byte, a varint length and the payload. A RESULTS frame has the count of its
+        results, and each result as a kind byte, the start and end lines (+1, so 0 is unknown) as varints, the
+        name (or the text) as a string and the file as a string reference. Strings are a varint length and the
+        utf-8 bytes, and the file references are indexes of the files already sent in the response, or the next
+        index followed by the new file string. An ERROR frame has the utf-8 message, and the END frame has the
+        count of results as a varint.
+"""
+import sys
+import json
+import time
+import Queue
+import threading
+
+from inspector.models.base import Class, Method
+from inspector.models.serialization import write_varint, read_varint
+
+
+CHUNK_SIZE = 64
+FLUSH_INTERVAL = 0.05  # seconds
+
+# kinds of the results
+TEXT, CLASS, METHOD = range(3)
+KIND_NAMES = ['text', 'class', 'method']
+
+# binary frame types
+RESULTS, ERROR, END = range(1, 4)
+
+
+def result_kind(result):
+    if isinstance(result, Class):
+        return CLASS
+    if isinstance(result, Method):
+        return METHOD
+    return TEXT
+
+
+def result_record(result):
+    """ Return the fields of the result, as a dict of kind, name, file, start_line and end_line
+         note: only the kind and text are set for texts
+    """
+    kind = result_kind(result)
+    if kind == TEXT:
+        return {'kind': KIND_NAMES[kind], 'text': result if isinstance(result, basestring) else unicode(result)}
+    source_file = result.source_file
+    return {
+        'kind': KIND_NAMES[kind],
+        'name': result.qualified_name,
+        'file': source_file.project_path or source_file.filename if source_file else None,
+        'start_line': result.starting_line,
+        'end_line': result.ending_line,
+    }
+
+
+class ResultEncoder(object):
+    """ Encoder of the results of a request, a new one is used for each response
+    """
+    name = None
+
+    def __init__(self):
+        self.count = 0  # results encoded so far
+
+    def encode_response(self, results, chunk_size=CHUNK_SIZE, flush_interval=FLUSH_INTERVAL):
+        """ Yield the encoded chunks of the response, as the results are found
+             note: the results are iterated in another thread, so the found results are flushed while the
+                   next ones are searched, and the search is not slowed down by sending them (they are queued)
+
+            :param results: iterable of the results, an error raised while iterating (a ValueError) is sent
+                            after the results found before it, other errors are raised (after the chunk of
+                            the results found before them)
+            :rtype: collections.Iterable[str]
+        """
+        queue = Queue.Queue()
+        stopped = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(results, queue, stopped))
+        thread.daemon = True
+        thread.start()
+
+        chunk = []
+        deadline = None  # when the chunk must be flushed
+        try:
+            while True:
+                try:
+                    kind, value = queue.get(timeout=max(deadline - time.time(), 0) if chunk else None)
+                except Queue.Empty:
+                    yield self.encode_results(chunk)
+                    chunk = []
+                    continue
+                if kind != 'result':
+                    break
+                if not chunk:
+                    deadline = time.time() + flush_interval
+                chunk.append(value)
+                if len(chunk) >= chunk_size:
+                    yield self.encode_results(chunk)
+                    chunk = []
+            if chunk:
+                yield self.encode_results(chunk)
+            if kind == 'exception':
+                raise value[0], value[1], value[2]
+            if kind == 'error':
+                yield self.encode_error(value)
+            yield self.encode_end()
+        finally:
+            stopped.set()  # e.g. if the client is disconnected
+
+    @staticmethod
+    def _produce(results, queue, stopped):
+        try:
+            for result in results:
+                if stopped.is_set():
+                    return
+                queue.put(('result', result))
+        except ValueError as e:
+            queue.put(('error', format(e)))
+        except Exception:
+            queue.put(('exception', sys.exc_info()))
+        else:
+            queue.put(('end', None))
+        finally:
+            if hasattr(results, 'close'):
+                results.close()  # e.g. releasing the locks held by a generator, if stopped
+
+    def encode_results(self, results):
+        self.count += len(results)
+        return self._encode_results(results)
+
+    def _encode_results(self, results):
+        raise NotImplementedError()
+
+    def encode_error(self, message):
+        raise NotImplementedError()
+
+    def encode_end(self):
+        raise NotImplementedError()
+
+
+class TextEncoder(ResultEncoder):
+    name = 'text'
+
+    @staticmethod
+    def encode_line(line):
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        return line.strip() + '\n'
+
+    def _encode_results(self, results):
+        return ''.join(self.encode_line(r if isinstance(r, basestring) else repr(r)) for r in results)
+
+    def encode_error(self, message):
+        return self.encode_line(u'ERROR: {0}'.format(message))
+
+    def encode_end(self):
+        return '\n'
+
+
+class JsonLinesEncoder(ResultEncoder):
+    name = 'json'
+
+    @staticmethod
+    def encode_line(obj):
+        # non-ascii chars are escaped, so the objects have no newlines
+        return json.dumps(obj, separators=(',', ':'), sort_keys=True) + '\n'
+
+    def _encode_results(self, results):
+        return ''.join(self.encode_line(result_record(r)) for r in results)
+
+    def encode_error(self, message):
+        return self.encode_line({'error': message})
+
+    def encode_end(self):
+        return self.encode_line({'end': True, 'count': self.count})
+
+
+def _write_string(buf, s):
+    if isinstance(s, unicode):
+        s = s.encode('utf-8')
+    write_varint(buf, len(s))
+    buf.extend(s)
+
+
+class BinaryEncoder(ResultEncoder):
+    name = 'binary'
+
+    def __init__(self):
+        super(BinaryEncoder, self).__init__()
+        self._files = {}  # file -> index, of the files sent in this response
+
+    @staticmethod
+    def encode_frame(frame_type, payload):
+        buf = bytearray([frame_type])
+        write_varint(buf, len(payload))
+        buf.extend(payload)
+        return str(buf)
+
+    def _encode_results(self, results):
+        buf = bytearray()
+        write_varint(buf, len(results))
+        for r in results:
+            kind = result_kind(r)
+            buf.append(kind)
+            if kind == TEXT:
+                buf.extend('\0\0')  # no lines
+                _write_string(buf, r if isinstance(r, basestring) else unicode(r))
+                buf.append(0)  # no file
+                continue
+            record = result_record(r)
+            write_varint(buf, record['start_line'] + 1 if record['start_line'] is not None else 0)
+            write_varint(buf, record['end_line'] + 1 if record['end_line'] is not None else 0)
+            _write_string(buf, record['name'])
+            # files are sent once, and then referenced, 0 is no file
+            f = record['file']
+            if f is None:
+                buf.append(0)
+            elif f in self._files:
+                write_varint(buf, self._files[f])
+            else:
+                self._files[f] = len(self._files) + 1
+                write_varint(buf, self._files[f])
+                _write_string(buf, f)
+        return self.encode_frame(RESULTS, buf)
+
+    def encode_error(self, message):
+        return self.encode_frame(ERROR, message.encode('utf-8') if isinstance(message, unicode) else message)
+
+    def encode_end(self):
+        buf = bytearray()
+        write_varint(buf, self.count)
+        return self.encode_frame(END, buf)
+
+
+ENCODERS = dict((e.name, e) for e in [TextEncoder, JsonLinesEncoder, BinaryEncoder])
+
+
+#############
+#  Clients  #
+#############
+def read_json_response(f):
+    """ Yield the result records of a json response, read from the file-like object (e.g. socket.makefile())
+
+        :raise ValueError: if the response has an error, after yielding the results sent before it
+    """
+    error = None
+    for line in iter(f.readline, ''):
+        obj = json.loads(line)
+        if 'error' in obj:
+            error = obj['error']  # raised after reading the end, so the next response can be read
+        elif obj.get('end'):
+            if error is not None:
+                raise ValueError(error)
+            return
+        else:
+            yield obj
+    raise ValueError('Connection closed')
+
+
+class BinaryDecoder(object):
+    """ Decoder of binary responses, reading the frames from a file-like object (e.g. socket.makefile('rb'))
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def _read(self, n):
+        data = self.f.read(n)
+        if len(data) != n:
+            raise ValueError('Connection closed')
+        return data
+
+    def read_frame(self):
+        frame_type = ord(self._read(1))
+        length = shift = 0
+        while True:
+            b = ord(self._read(1))
+            length |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        return frame_type, bytearray(self._read(length))
+
+    @staticmethod
+    def _read_string(data, pos):
+        length, pos = read_varint(data, pos)
+        return str(data[pos:pos + length]).decode('utf-8'), pos + length
+
+    def read_response(self):
+        """ Yield the result records of a response, like result_record
+
+            :raise ValueError: if the response has an error, after yielding the results sent before it
+        """
+        files = [None]
+        error = None
+        while True:
+            frame_type, data = self.read_frame()
+            if frame_type == END:
+                if error is not None:
+                    raise ValueError(error)
+                return
+            if frame_type == ERROR:
+                error = str(data).decode('utf-8')  # raised after reading the end, like read_json_response
+                continue
+            if frame_type != RESULTS:
+                raise ValueError('Invalid frame type: {0}'.format(frame_type))
+            count, pos = read_varint(data, 0)
+            for _ in xrange(count):
+                kind = data[pos]
+                start, pos = read_varint(data, pos + 1)
+                end, pos = read_varint(data, pos)
+                name, pos = self._read_string(data, pos)
+                file_index, pos = read_varint(data, pos)
+                if file_index == len(files):
+                    f, pos = self._read_string(data, pos)
+                    files.append(f)
+                if kind == TEXT:
+                    yield {'kind': KIND_NAMES[kind], 'text': name}
+                    continue
+                yield {'kind': KIND_NAMES[kind], 'name': name, 'file': files[file_index],
+                       'start_line': start - 1 if start else None, 'end_line': end - 1 if end else None}
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
 import re
 from inspector.models.android import AndroidProject
 from inspector.models.base import Method
+from inspector.models.cache import ParseCache
+from inspector.saql.planner import QueryPlanner
 from inspector.saql.saql_parser import SaqlParser
+from inspector.utils.lang import LRUCache
 
 
 class SAMS(object):
@@ -39,11 +43,30 @@ class SAMS(object):
         }
     }
 
-    def __init__(self):
+    def __init__(self, cache_dir=None):
+        """
+            :param str or None cache_dir: directory to cache parsed files in, to not parse them again when
+                                          a project is (re)loaded
+        """
         self.project = None
+        self.parse_cache = ParseCache(cache_dir) if cache_dir else None
+        self.planner = QueryPlanner(self)
+        self.query_cache = LRUCache(max_size=256)  # compiled query plans, by (query, project generation)
 
-    def open_project(self, project_path):
+    def open_project(self, project_path, snapshot_path=None):
+        """
+            :param str project_path: root directory of the project
+            :param str or None snapshot_path: snapshot of the parsed project, so the files are not parsed again,
+                                              it is saved (parsing the whole project) if not exists or outdated
+        """
+        if self.project is not None:
+            self.project.close_snapshot()
         self.project = AndroidProject(project_path)
+        self.project.parse_cache = self.parse_cache
+        self.query_cache.clear()
+        if snapshot_path is not None:
+            if not os.path.exists(snapshot_path) or not self.project.open_snapshot(snapshot_path):
+                self.project.save_snapshot(snapshot_path)
 
     def parse_identifier(self, identifier):
         if identifier == ['project'] or identifier == 'project':
@@ -69,80 +92,104 @@ class SAMS(object):
             raise ValueError('Query not applicable on these types: {0}'.format(query_def))
 
     def select_candidate_classes(self, query):
-        """ Give all classes that match queries FROM clause
+        """ Yield all classes that match queries FROM clause, files are loaded (and parsed) as they are reached
 
             :param SaqlQuery query: the query
-            :rtype: list of inspector.models.base.Class
+            :rtype: collections.Iterable[inspector.models.base.Class]
         """
-        classes = []
         for obj in self.parse_identifier(query.select_from):
-            classes += obj.classes
-        return classes
+            for cls in obj.classes:
+                yield cls
 
     def select_candidate_methods(self, query):
-        """ Give all methods that match queries FROM clause
+        """ Yield all methods that match queries FROM clause
 
             :param SaqlQuery query: the query
-            :rtype: list of inspector.models.base.Method
+            :rtype: collections.Iterable[inspector.models.base.Method]
         """
-        methods = []
         if query.select_from_type != 'class':
             candidate_classes = self.select_candidate_classes(query)
         else:
             candidate_classes = self.parse_identifier(query.select_from)
         for cc in candidate_classes:
-            methods += cc.methods
-        return methods
+            for m in cc.methods:
+                yield m
+
+    def plan_query(self, query):
+        """
+            :param SaqlQuery query: a parsed select query
+            :rtype: inspector.saql.planner.QueryPlan
+        """
+        sel = ['?', query.select_from_type]
+        if query.is_select_classes():
+            sel[0] = 'class'
+        elif query.is_select_methods():
+            sel[0] = 'method'
+        elif query.is_select_lines():
+            sel[0] = 'line'
+        elif query.is_select_instances():
+            sel[0] = 'instance'
+        else:
+            raise ValueError('Unsupported query type: {0}'.format(query.select_type))
+        self.verify_query(sel)
+        return self.planner.plan(query, sel[0])
+
+    def compile_query(self, query):
+        """ Return the plan of the query, compiled plans are reused until the project files change
+
+            :param str query: the query text
+            :rtype: inspector.saql.planner.QueryPlan
+        """
+        self.project.files  # scanning the files if not scanned yet, before using the generation
+        key = (query, self.project.generation)
+        plan = self.query_cache.get(key)
+        if plan is None:
+            q = SaqlParser.parse_query(query)
+            if not q.is_select():
+                raise ValueError('Unsupported query')
+            plan = self.plan_query(q)
+            self.query_cache.put(key, plan)
+        return plan
 
     def run_query(self, query):
+        """ Run the query, returning the selected objects (or the query plan for EXPLAIN queries)
+        """
+        if not self.project:
+            raise ValueError('No project selected!')
+
+        plan = self.compile_query(query)
+        if plan.query.explain:
+            return plan.explain()
+        return plan.execute()
+
+    def iter_query(self, query):
+        """ Run the query, returning an iterator of the selected objects, which are found (and the files are
+             parsed) as the results are consumed (for EXPLAIN queries, the lines of the query plan are returned)
+            :raise ValueError: if the query is invalid
+        """
         if not self.project:
             raise ValueError('No project selected!')
 
-        q = SaqlParser.parse_query(query)
-
-        if q.is_select():
-            # first gathering all candidates
-            sel = ['?', q.select_from_type]
-            objects = []
-            if q.is_select_classes():
-                sel[0] = 'class'
-                self.verify_query(sel)
-                objects = self.select_candidate_classes(q)
-            elif q.is_select_methods():
-                sel[0] = 'method'
-                self.verify_query(sel)
-                objects = self.select_candidate_methods(q)
-            elif q.is_select_lines():
-                sel[0] = 'line'
-                self.verify_query(sel)
-            elif q.is_select_instances():
-                sel[0] = 'instance'
-                self.verify_query(sel)
-            else:
-                raise ValueError('Unsupported query type: {0}'.format(q.select_type))
-
-            # filtering by WHERE conditions
-            for wcl in q.where_conditions:
-                # TODO: support operators on functions too
-                m = re.match(r'^\s*(\w+)\s*\((.*?)\)\s*$', wcl)
-                if not m:
-                    raise ValueError('Invalid WHERE condition: {0}'.format(wcl))
-                fn_name = m.group(1)
-                fn_params = [self.parse_token(s) for s in m.group(2).split(',')] if m.group(2) else []
-                try:
-                    fn_callable = self.QUERY_DEF['FUNCTIONS'][sel[0]][fn_name]
-                except KeyError:
-                    raise ValueError('Invalid function for {1} object: {0}'.format(fn_name, sel[0]))
-                objects = filter(lambda o: fn_callable(o, *fn_params), objects)
-
-            return objects
-
-        raise ValueError('Unsupported query')
+        plan = self.compile_query(query)
+        if plan.query.explain:
+            return iter(plan.explain().split(u'\n'))
+        return plan.iter_results()
 
     def run_action(self, action):
         if action.startswith(r'\c '):
             self.open_project(action[3:])
             return "Project loaded"
+        if action.startswith(r'\s '):
+            if not self.project:
+                raise ValueError('No project selected!')
+            failures = self.project.save_snapshot(action[3:])
+            return 'Snapshot saved: {0} files could not be parsed'.format(len(failures))
+        if action == r'\r':
+            if not self.project:
+                raise ValueError('No project selected!')
+            diff = self.project.rescan_files()
+            return 'Project rescanned: {0} added, {1} changed, {2} removed'.format(
+                len(diff.added), len(diff.changed), len(diff.removed))
         raise ValueError('Invalid Action: {0}'.format(action))
 
     def run(self, command):
@@ -153,3 +200,11 @@ class SAMS(object):
             return self.run_action(command)
         else:
             return self.run_query(command)
+
+    def stream(self, command):
+        """ Like run, but returning an iterator of the results, so they can be sent as soon as they are found
+        """
+        if command.startswith('\\'):
+            return iter([self.run_action(command)])
+        else:
+            return self.iter_query(command)
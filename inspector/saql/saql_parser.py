@@ -7,11 +7,17 @@ class SaqlQuery(object):
         self.select_type = None
         self.select_from = []
         self.where_conditions = []
+        self.explain = False  # whether the query plan is requested, instead of the results
+        self.limit = None  # maximum number of the results
 
     def __unicode__(self):
         qs = u'SELECT {0} FROM {1}'.format(self.select_type, u','.join(self.select_from))
         if self.where_conditions:
             qs += u' WHERE ' + u' AND '.join(self.where_conditions)
+        if self.limit is not None:
+            qs += u' LIMIT {0}'.format(self.limit)
+        if self.explain:
+            qs = u'EXPLAIN ' + qs
         return qs
 
     @property
@@ -49,13 +55,16 @@ class SaqlParser(object):
         """
             :rtype: SaqlQuery
         """
-        m = re.match(r'^SELECT\s+(.*?)\s+FROM\s+(.*?)(?:\s+WHERE\s+(.*?))?$', query)
+        m = re.match(r'^(EXPLAIN\s+)?SELECT\s+(.*?)\s+FROM\s+(.*?)(?:\s+WHERE\s+(.*?))?(?:\s+LIMIT\s+(\d+))?$',
+                     query)
         if not m:
             raise ValueError('Invalid Query!')
 
         q = SaqlQuery()
-        q.select_type = m.group(1).strip()
-        q.select_from = [s.strip() for s in m.group(2).split(',')]
-        wcl = m.group(3)
+        q.explain = m.group(1) is not None
+        q.select_type = m.group(2).strip()
+        q.select_from = [s.strip() for s in m.group(3).split(',')]
+        wcl = m.group(4)
         q.where_conditions = [s.strip() for s in wcl.split(' AND ')] if wcl else []
+        q.limit = int(m.group(5)) if m.group(5) is not None else None
         return q
@@ -1,52 +1,233 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+""" SAQL server, running the queries of many concurrent clients on a shared SAMS
+
+    Protocol: each request is a line (a query or an action, like in the interpreter), and its response is the
+    results, sent in chunks as they are found, in the format of the connection (see inspector.saql.protocol).
+    The format is text by default, and is changed by '\\f <format>' (text, json or binary), whose response is
+    in the new format. '\\q' closes the connection.
+"""
 import os
 import sys
 import time
+import errno
+import select
+import signal
 import socket
+import logging
+import threading
+import SocketServer
+from contextlib import contextmanager
 
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', '..', 'static-inspector'))
+from inspector.saql.protocol import ENCODERS, TextEncoder
 from inspector.saql.sams import SAMS
 
 
 TCP_IP = '127.0.0.1'
 TCP_PORT = 6789
-BUFFER_SIZE = 102400  # Normally 1024, but we want fast response
+BUFFER_SIZE = 4096
+MAX_REQUEST_SIZE = 1024 * 1024  # longer requests close the connection
+POLL_INTERVAL = 0.5  # seconds, idle connections check if the server is shutting down this often
+
+logger = logging.getLogger('saqld')
+
+
+class ReadWriteLock(object):
+    """ A lock that is either shared by many holders (e.g. running queries), or held exclusively by one
+         (e.g. an action changing the project)
+
+        Waiting for the exclusive lock blocks new shared holders, so the actions are not starved by the queries.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class SaqlRequestHandler(SocketServer.BaseRequestHandler):
+    """ Handler of a client connection, run in its own thread, so slow queries do not block other clients
+    """
+
+    def setup(self):
+        self.encoder_class = TextEncoder
+        self.client = '{0}:{1}'.format(*self.client_address[:2])
+        self.server.add_handler(self)
+        logger.info('%s connected', self.client)
+
+    def finish(self):
+        self.server.remove_handler(self)
+        logger.info('%s disconnected', self.client)
+
+    def handle(self):
+        buf = ''
+        while not self.server.stopping:
+            # polling, so idle connections are closed when the server is shutting down
+            if not select.select([self.request], [], [], POLL_INTERVAL)[0]:
+                continue
+            data = self.request.recv(BUFFER_SIZE)
+            if not data:
+                break
+            buf += data
+            while '\n' in buf:
+                line, buf = buf.split('\n', 1)
+                command = line.strip()
+                if command == '\\q':
+                    return
+                if command:
+                    self.handle_command(command)
+            if len(buf) > MAX_REQUEST_SIZE:
+                self.send_error('Request too long')
+                break
+
+    def handle_command(self, command):
+        if command.startswith('\\f '):
+            self.set_format(command[3:].strip())
+            return
+        start_time = time.time()
+        encoder = self.encoder_class()
+        sent = 0
+        try:
+            for chunk in encoder.encode_response(self.iter_results(command)):
+                self.request.sendall(chunk)
+                sent += len(chunk)
+        except socket.error:
+            raise  # the client is disconnected
+        except Exception as e:
+            # unexpected errors (e.g. IOError of saving a snapshot) end the response, not the connection
+            logger.exception('%s %r failed', self.client, command)
+            chunk = encoder.encode_error(u'{0}: {1}'.format(type(e).__name__, e)) + encoder.encode_end()
+            self.request.sendall(chunk)
+            sent += len(chunk)
+        logger.info('%s %r: %d results, %d bytes, %.1fms', self.client, command, encoder.count, sent,
+                    (time.time() - start_time) * 1000)
+
+    def iter_results(self, command):
+        # a generator, so the errors of compiling the query are sent like the errors of running it
+        # actions change the project, so they wait for the running queries, and the queries wait for them, the
+        #  lock is held while the results are found, not while they are sent (see ResultEncoder.encode_response)
+        lock = self.server.lock.exclusive() if command.startswith('\\') else self.server.lock.shared()
+        with lock:
+            for result in self.server.sams.stream(command):
+                yield result
+
+    def set_format(self, name):
+        if name not in ENCODERS:
+            self.send_error('Invalid format: {0}, must be one of: {1}'.format(name, ', '.join(sorted(ENCODERS))))
+            return
+        self.encoder_class = ENCODERS[name]
+        for chunk in self.encoder_class().encode_response([u'Format: {0}'.format(name)]):
+            self.request.sendall(chunk)
+
+    def send_error(self, message):
+        encoder = self.encoder_class()
+        self.request.sendall(encoder.encode_error(message) + encoder.encode_end())
+
+
+class SaqlServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """ Threaded SAQL server, the clients share a SAMS (and its loaded project)
+    """
+    allow_reuse_address = True
+    daemon_threads = True  # stuck clients do not keep the process alive, shutdown waits for the others
+
+    def __init__(self, address, sams):
+        """
+            :param tuple address: (host, port) to listen on, port 0 picks a free one
+            :param SAMS sams: the shared SAMS
+        """
+        SocketServer.TCPServer.__init__(self, address, SaqlRequestHandler)
+        self.sams = sams
+        self.lock = ReadWriteLock()
+        self.stopping = False
+        self._handlers = set()
+        self._handlers_lock = threading.Lock()
+
+    def add_handler(self, handler):
+        with self._handlers_lock:
+            self._handlers.add(handler)
+
+    def remove_handler(self, handler):
+        with self._handlers_lock:
+            self._handlers.discard(handler)
+
+    @property
+    def connections_count(self):
+        with self._handlers_lock:
+            return len(self._handlers)
+
+    def shutdown_gracefully(self, timeout=10.):
+        """ Stop accepting connections, and wait for the running requests to finish (at most timeout seconds)
+             note: must not be called from the thread running serve_forever
+        """
+        self.stopping = True
+        self.shutdown()
+        deadline = time.time() + timeout
+        while self.connections_count and time.time() < deadline:
+            time.sleep(0.05)
+        self.server_close()
+
+
+def _get_arg(name, default=None):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
 
 
 if __name__ == '__main__':
-    sams = SAMS()
-    print "Server Up!"
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind((TCP_IP, TCP_PORT))
-    s.listen(1)
-
-    print "Waiting for client connection..."
-    conn, addr = s.accept()
-    print "Client connected!"
-
-    while 1:
-        data = conn.recv(BUFFER_SIZE)
-        if not data:
-            break
-        print "Received data:", data
-
-        qs = data.strip()
-        if qs == '\q':
-            break
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    sams = SAMS(cache_dir=_get_arg('-c'))
+    if '-d' in sys.argv:
+        sams.open_project(_get_arg('-d'), snapshot_path=_get_arg('-s'))  # otherwise selected by the clients
+    server = SaqlServer((TCP_IP, int(_get_arg('-p', TCP_PORT))), sams)
+
+    def stop(signum, frame):
+        logger.info('Shutting down...')
+        # shutdown waits for serve_forever to return, so it must be called from another thread
+        threading.Thread(target=server.shutdown_gracefully).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info('Server up on %s:%d', *server.server_address)
+    while not server.stopping:
         try:
-            start_time = time.time()
-            result = sams.run(qs)
-            d = time.time() - start_time
-        except ValueError as e:
-            result = 'ERROR: {0}'.format(e.message)
-            d = 0
-
-        if not result:
-            result = 'None'
-        result = str(result).strip() + '\n'
-        conn.send(result)
-        print('{0:.1f}ms, {1} chars sent'.format(d * 1000, len(result)))
-
-    print('bye!')
-    conn.close()
+            server.serve_forever()
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise  # interrupted by the signals, otherwise
+    logger.info('bye!')
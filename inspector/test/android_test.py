@@ -4,7 +4,7 @@ import unittest
 
 from inspector.models.android import AndroidProject
 from inspector.models.base import Method
-from inspector.models.consts import Language
+from inspector.models.consts import Language, ParseMode
 from inspector.utils.strings import has_word
 
 
@@ -21,8 +21,9 @@ class TestAndroid(unittest.TestCase):
         sf = self.project.get_file('sample_files/IssuesFragment.java')
         self.assertTrue(sf.language_detected)
         self.assertEqual(sf.language, Language.JAVA)
-        self.assertTrue(sf.parsed)
+        self.assertFalse(sf.parsed)  # parsed on demand
         self.assertEqual(len(sf.imports), 43)
+        self.assertTrue(sf.parsed)
 
         # specific check for one import
         im = sf.imports[13]
@@ -59,7 +60,50 @@ class TestAndroid(unittest.TestCase):
         self.assertEqual(mt.name, 'openPullRequestCommits')
         self.assertEqual(mt.access, Method.ACCESS.PRIVATE)
 
+    def test_find_anonymous(self):
+        cls = self.project.find('class:sample_files.IssueFragment$10')
+        self.assertEqual(cls.extends, ['RefreshIssueTask'])
+        mt = self.project.find('method:sample_files.IssueFragment$10.onSuccess')
+        self.assertIs(mt.parent_class, cls)
+
+        symbol = self.project.symbols.get('method', 'sample_files.IssueFragment$5.onClick')
+        self.assertEqual(symbol.path, 'sample_files/IssueFragment.java')
+        self.assertEqual((symbol.starting_line, symbol.ending_line), (292, 296))
+        self.assertIsNone(self.project.find('method:sample_files.IssueFragment$11.onClick'))
+
+    def test_symbol_index(self):
+        self.assertListEqual(self.project.build_symbol_index(workers=1), [])
+        symbols = list(self.project.symbols)
+        self.assertEqual(len([s for s in symbols if s.kind == 'class']), 2 + 10 + 2)
+        self.assertEqual(len([s for s in symbols if s.kind == 'method' and '$' not in s.qualified_name]), 15 + 14)
+        field = self.project.find('field:sample_files.IssueFragment.issueNumber')
+        self.assertIsNotNone(field)
+        self.assertIs(field.parent_class, self.project.find('class:sample_files.IssueFragment'))
+
     def test_java_parse_1(self):
         sf = self.project.get_file('sample_files/IssueFragment.java')
         cls = sf.get_class('IssueFragment')
         self.assertEqual(len(cls.fields), 34)
+
+        # line numbers must stay correct after the parser rewinds over anonymous classes
+        mt = cls.get_method('onActivityCreated')
+        self.assertEqual(mt.starting_line, 226)
+        self.assertEqual(mt.ending_line, 249)
+
+    def test_parse_headers(self):
+        full_sf = self.project.get_file('sample_files/IssueFragment.java')
+        project = AndroidProject(self.project.abs_path)
+        project.parse_mode = ParseMode.HEADERS
+        sf = project.get_file('sample_files/IssueFragment.java')
+        self.assertEqual(sf.parse_mode, ParseMode.HEADERS)
+        self.assertEqual(len(sf.imports), len(full_sf.imports))
+        cls, full_cls = sf.get_class('IssueFragment'), full_sf.get_class('IssueFragment')
+        self.assertEqual(len(cls.fields), 34)
+        self.assertListEqual([(m.name, m.starting_line, m.ending_line) for m in cls.methods],
+                             [(m.name, m.starting_line, m.ending_line) for m in full_cls.methods])
+
+        # method bodies are skipped
+        mt = cls.get_method('onActivityCreated')
+        self.assertEqual((mt.starting_line, mt.ending_line), (226, 249))
+        self.assertListEqual(mt.statements, [])
+        self.assertListEqual(mt.nested_classes, [])
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from inspector.models import cache
+from inspector.models.cache import ParseCache
+from inspector.models.consts import ParseMode
+from inspector.models.java import JavaProject, JavaSourceFile
+from inspector.models.serialization import ModelReader
+
+
+class CountingJavaProject(JavaProject):
+    def __init__(self, *args, **kwargs):
+        self.loaded_files = []
+        super(CountingJavaProject, self).__init__(*args, **kwargs)
+
+    def load_file(self, rel_path):
+        self.loaded_files.append(rel_path)
+        return super(CountingJavaProject, self).load_file(rel_path)
+
+
+class ParseCacheTest(unittest.TestCase):
+    SOURCE = 'class A {\n    void f() {\n        int x = 1;\n    }\n}\n'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.path, 'cache')
+        self.project_path = os.path.join(self.path, 'project')
+        os.makedirs(self.project_path)
+        self.filename = os.path.join(self.project_path, 'A.java')
+        self.write_source(self.SOURCE)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_source(self, content, mtime=None):
+        with open(self.filename, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(self.filename, (mtime, mtime))
+
+    def test_get_put(self):
+        pc = ParseCache(self.cache_dir)
+        self.assertIsNone(pc.get(self.filename))
+        pc.put(JavaSourceFile(self.filename))
+        sf = pc.get(self.filename)
+        self.assertEqual(sf.get_class('A').get_method('f').lines_count, 3)
+        self.assertEqual(sf.get_line(3), '        int x = 1;\n')
+        self.assertIsNone(pc.get(self.filename, tag='other'))
+
+    def test_invalidation(self):
+        pc = ParseCache(self.cache_dir)
+        mtime = time.time() - 100
+        self.write_source(self.SOURCE, mtime=mtime)
+        sf = JavaSourceFile(self.filename)
+        sf.ensure_parsed()
+        pc.put(sf)
+
+        # touched, but not changed
+        self.write_source(self.SOURCE, mtime=mtime + 10)
+        sf = pc.get(self.filename)
+        self.assertIsNotNone(sf)
+        self.assertEqual(sf.get_class('A').get_method('f').statements[0].code, 'int x = 1;')
+        # the new mtime is saved, so the content is not hashed again
+        with open(pc.entry_path(self.filename), 'rb') as f:
+            self.assertAlmostEqual(ModelReader(f.read()).read('header')['mtime'], mtime + 10, places=3)
+
+        # changed, with the same size
+        self.write_source(self.SOURCE.replace('x', 'y'), mtime=mtime + 20)
+        self.assertIsNone(pc.get(self.filename))
+
+        pc.put(JavaSourceFile(self.filename))
+        self.assertIsNotNone(pc.get(self.filename))
+        self.write_source(self.SOURCE + '\n')
+        self.assertIsNone(pc.get(self.filename))
+
+    def test_parser_version(self):
+        pc = ParseCache(self.cache_dir)
+        pc.put(JavaSourceFile(self.filename))
+        old_version = cache.PARSER_VERSION
+        cache.PARSER_VERSION += 1
+        try:
+            self.assertIsNone(pc.get(self.filename))
+        finally:
+            cache.PARSER_VERSION = old_version
+        self.assertIsNotNone(pc.get(self.filename))
+
+    def test_invalid_entry(self):
+        pc = ParseCache(self.cache_dir)
+        pc.put(JavaSourceFile(self.filename))
+        with open(pc.entry_path(self.filename), 'r+b') as f:
+            f.truncate(20)
+        self.assertIsNone(pc.get(self.filename))
+
+    def test_eviction(self):
+        pc = ParseCache(self.cache_dir)
+        pc.put(JavaSourceFile(self.filename), tag='1')
+        entry_size = pc.total_size()
+        pc.max_size = 2 * entry_size
+        pc.put(JavaSourceFile(self.filename), tag='2')
+        os.utime(pc.entry_path(self.filename, tag='1'), (time.time() - 100, time.time() - 100))
+        self.assertIsNotNone(pc.get(self.filename, tag='2'))
+        pc.put(JavaSourceFile(self.filename), tag='3')
+        self.assertEqual(len(pc.entries()), 2)
+        self.assertEqual(pc.total_size(), 2 * entry_size)
+        self.assertIsNone(pc.get(self.filename, tag='1'))
+        self.assertIsNotNone(pc.get(self.filename, tag='2'))
+        self.assertIsNotNone(pc.get(self.filename, tag='3'))
+
+    def test_project_cache(self):
+        project = CountingJavaProject(self.project_path)
+        project.parse_cache = ParseCache(self.cache_dir)
+        self.assertEqual(project.get_file('A').get_class('A').name, 'A')
+        self.assertListEqual(project.loaded_files, ['A.java'])
+
+        # a warm start does not parse the file again
+        project = CountingJavaProject(self.project_path)
+        project.parse_cache = ParseCache(self.cache_dir)
+        sf = project.get_file('A')
+        self.assertEqual(sf.project_path, 'A.java')
+        self.assertEqual(sf.get_class('A').qualified_name, 'A')
+        self.assertListEqual(project.loaded_files, [])
+        project = CountingJavaProject(self.project_path)
+        project.parse_cache = ParseCache(self.cache_dir)
+        self.assertListEqual(project.parse_all(workers=2), [])
+        self.assertListEqual(project.loaded_files, [])
+
+        # files parsed in another mode are not reused
+        project = CountingJavaProject(self.project_path)
+        project.parse_cache = ParseCache(self.cache_dir)
+        project.parse_mode = ParseMode.HEADERS
+        self.assertListEqual(project.get_file('A').get_class('A').get_method('f').statements, [])
+        self.assertListEqual(project.loaded_files, ['A.java'])
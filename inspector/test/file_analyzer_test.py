@@ -22,3 +22,14 @@ class TestFileAnalyzer(unittest.TestCase):
 
         f2 = File(os.path.join(self.data_path, 'hello_world.cpp'))
         self.assertEqual(FileAnalyzer.estimate_file_size(f2), (107, 7))
+
+    def test_memory_mapped(self):
+        for filename, size in [('hello_world.out', (8, 8)), ('hello_world.cpp', (107, 7))]:
+            f = File(os.path.join(self.data_path, filename), use_mmap=True)
+            self.assertEqual(FileAnalyzer.estimate_file_size(f), size)
+            self.assertEqual(f.chars_count, File(os.path.join(self.data_path, filename)).chars_count)
+
+        f = File(os.path.join(self.data_path, 'hello_world.cpp'), use_mmap=True)
+        self.assertEqual(f.get_line(7), '}\n')
+        f.unload_content()
+        self.assertFalse(f.loaded)
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
-from inspector.models.base import SourceFile
+from inspector.models.base import SourceFile, SwitchBlock, IfBlock, Function, Comment
 from inspector.models.consts import Language
-from inspector.models.java import JavaClass
+from inspector.models.exceptions import ContentChangedError
+from inspector.parser.base import Token
+from inspector.models.java import (JavaClass, JavaSourceFile, JavaInterface, JavaAnonymousClass, JavaMethod,
+                                   JavaSynchronizedBlock, JavaTokenStream, header_candidates)
 
 
 # TODO: test details!
@@ -25,6 +31,15 @@ class TestJavaParse(unittest.TestCase):
         self.assertEqual(len(c1.methods), 1)
         self.assertEqual(c1.get_method('main').lines_count, 19)
 
+    def test_parse_memory_mapped(self):
+        filename = os.path.join(self.data_path, 'sample_sources', '7.java')
+        sf = JavaSourceFile(filename)
+        mapped_sf = JavaSourceFile(filename, use_mmap=True)
+        self.assertEqual(unicode(mapped_sf), unicode(sf))
+        cls, mapped_cls = sf.get_class('AnonymousClass1'), mapped_sf.get_class('AnonymousClass1')
+        self.assertListEqual([(m.name, m.starting_line, m.ending_line) for m in mapped_cls.methods],
+                             [(m.name, m.starting_line, m.ending_line) for m in cls.methods])
+
     def test_parse_2(self):
         sf = SourceFile.build_source_file(os.path.join(self.data_path, 'sample_sources', '2.java'))
         self.assertEqual(unicode(sf), u'Java SourceFile: 1 classes')
@@ -104,6 +119,68 @@ class TestJavaParse(unittest.TestCase):
         aclass1 = sf.get_class('SwitchClass1')
         self.assertEqual(len(aclass1.fields), 4)
 
+    def test_token_stream(self):
+        filename = os.path.join(self.data_path, 'sample_sources', '8.java')
+        tokens = list(JavaTokenStream.from_file(filename))
+        self.assertEqual(len(tokens), 36)
+        self.assertTrue(all(t.model is None for t in tokens))
+        self.assertEqual(len([t for t in tokens if t.content.startswith('import ')]), 8)
+        self.assertListEqual([t.content for t in tokens if t.type == 'label'],
+                             ['case ISSUE_MILESTONE_UPDATE:', 'case ISSUE_ASSIGNEE_UPDATE:',
+                              'case ISSUE_LABELS_UPDATE:', 'case ISSUE_CLOSE:', 'case ISSUE_REOPEN:'])
+        controls = [t for t in tokens if t.type == 'control']
+        self.assertListEqual([(t.content, t.starting_line) for t in controls][::2],
+                             [('class SwitchClass1', 11), ('switch (requestCode)', 21)])
+        self.assertEqual(len([t for t in tokens if t.type == 'end-control']), len(controls))
+        st = tokens[-12]
+        self.assertEqual((st.type, st.starting_line, st.ending_line), ('statement', 31, 32))
+
+        # a parsed file gives the same tokens
+        sf = JavaSourceFile(filename)
+        sf.unload_content()
+        self.assertListEqual([(t.type, t.content) for t in sf.iter_tokens()], [(t.type, t.content) for t in tokens])
+
+    def test_source_offsets(self):
+        filename = os.path.join(self.data_path, 'sample_sources', '1.java')
+        sf = SourceFile.build_source_file(filename)
+        with open(filename) as f:
+            content = f.read()
+        st = sf.get_class('MyFirstProgram').get_method('main').statements[0]
+        code = 'BufferedReader in =\n        new BufferedReader(new InputStreamReader(System.in));'
+        self.assertEqual(st.code, code)
+        self.assertEqual(content[st.start:st.end], code)
+
+        # the code is read from the content again if it is unloaded
+        sf.unload_content()
+        self.assertEqual(st.code, code)
+        copied = pickle.loads(pickle.dumps(sf, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copied.get_class('MyFirstProgram').get_method('main').statements[0].code, code)
+
+        start = content.index('/**')
+        comment = Comment(source_file=sf, start=start, end=start + 28)
+        self.assertEqual(comment.source_text, '/** Print a hello message */')
+        self.assertEqual(comment.content, 'Print a hello message')
+        self.assertTrue(comment.doc_comment)
+
+    def test_changed_source(self):
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, 'A.java')
+            shutil.copy(os.path.join(self.data_path, 'sample_sources', '1.java'), filename)
+            sf = SourceFile.build_source_file(filename)
+            st = sf.get_class('MyFirstProgram').get_method('main').statements[0]
+            sf.unload_content()
+
+            # an edit keeping the size of the file, so the offsets are still in the content
+            with open(filename, 'r+') as f:
+                f.write('//')
+            mtime = os.path.getmtime(filename) + 10
+            os.utime(filename, (mtime, mtime))
+            self.assertRaises(ContentChangedError, getattr, st, 'code')
+            self.assertRaises(ContentChangedError, getattr, st, 'code')  # not read from the new content later
+        finally:
+            shutil.rmtree(path)
+
 
 class TestParseInternals(unittest.TestCase):
     def test_visibility_parse(self):
@@ -116,3 +193,30 @@ class TestParseInternals(unittest.TestCase):
         self.assertEqual(JavaClass.parse_access('public'), JavaClass.ACCESS.PUBLIC)
         self.assertEqual(JavaClass.parse_access('public '), JavaClass.ACCESS.PUBLIC)
         self.assertEqual(JavaClass.parse_access('published'), JavaClass.ACCESS.UNKNOWN)
+
+    def test_header_candidates(self):
+        self.assertListEqual(header_candidates('public class A extends B'), [JavaClass])
+        self.assertListEqual(header_candidates('interface I'), [JavaInterface])
+        self.assertListEqual(header_candidates('synchronized (lock)'), [JavaSynchronizedBlock, JavaMethod])
+        self.assertListEqual(header_candidates('a.b(new View.OnClickListener()'),
+                             [JavaAnonymousClass, JavaMethod])
+        self.assertListEqual(header_candidates('public void run()'), [JavaMethod])
+        self.assertListEqual(header_candidates('static'), [])
+
+    def test_context_tracking(self):
+        sf = SourceFile.build_source_file(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data', 'java',
+                                                        'sample_sources', '8.java'))
+        self.assertIsNone(sf.context_block)
+        cls, method, switch, block = (Token(model=JavaClass('A')), Token(model=Function('m')),
+                                      Token(model=SwitchBlock('x')), Token(model=IfBlock('y')))
+        for t in [cls, method, switch, block]:
+            sf.context_push(t)
+        self.assertEqual((sf.context_class, sf.context_function, sf.context_switch, sf.context_block),
+                         (cls, method, switch, block))
+        sf.context_pop()
+        sf.context_pop()
+        self.assertEqual((sf.context_class, sf.context_function, sf.context_switch, sf.context_block),
+                         (cls, method, None, method))
+        sf.context_pop()
+        sf.context_pop()
+        self.assertIsNone(sf.context_class)
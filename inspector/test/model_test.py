@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 import os
+import pickle
+import shutil
+import tempfile
+import threading
 import unittest
 
-from inspector.models.base import Comment, Project
+from inspector.models import base
+from inspector.models.base import Comment, Field, IfBlock, Project, Statement
 from inspector.models.java import JavaProject
+from inspector.parser.base import Token
 
 
 class BaseModelTest(unittest.TestCase):
@@ -23,6 +29,17 @@ class BaseModelTest(unittest.TestCase):
 
         self.assertRaises(ValueError, Comment, u'int x = 2;')
 
+    def test_compact_models(self):
+        block = IfBlock('x > 0')
+        block.add_statement(Statement('return x;'))
+        for model in [block, block.statements[0], Comment(u'// c'), Token(content='x'),
+                      Field('x', 'int', parent_class=None)]:
+            self.assertFalse(hasattr(model, '__dict__'))
+            self.assertRaises(AttributeError, setattr, model, 'unknown_attribute', 1)
+
+        copied = pickle.loads(pickle.dumps(block, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((copied.condition, copied.statements[0].code), ('x > 0', 'return x;'))
+
     def test_project_dfs_files(self):
         class TestFileDfsHandler(Project.FileDfsHandler):
             def __init__(self):
@@ -65,6 +82,255 @@ class LargeModelTest(unittest.TestCase):
         self.assertEqual(self.project.name, 'gissue')
         self.assertListEqual(self.project.source_roots, ['src'])
 
+    def test_parse_all(self):
+        serial = JavaProject(self.project.abs_path)
+        self.assertListEqual(serial.parse_all(workers=1), [])
+        self.assertListEqual(self.project.parse_all(workers=2), [])
+        self.assertItemsEqual(self.project._files.keys(), serial._files.keys())
+        for path, sf in serial._files.iteritems():
+            parallel_sf = self.project._files[path]
+            self.assertEqual(parallel_sf.project_path, path)
+            self.assertEqual(unicode(parallel_sf), unicode(sf))
+            self.assertItemsEqual([m.qualified_name for c in parallel_sf.classes for m in c.methods],
+                                  [m.qualified_name for c in sf.classes for m in c.methods])
+        # content is loaded again on demand
+        sf = self.project.get_file('src/com/g/issue/IssuesFragment.java')
+        self.assertEqual(sf.get_line(1), serial.get_file('src/com/g/issue/IssuesFragment.java').get_line(1))
+
+    def test_parse_all_failures(self):
+        path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(path, 'Broken.java'), 'w') as f:
+                f.write('class Broken {\n}\n}\n')
+            with open(os.path.join(path, 'Fine.java'), 'w') as f:
+                f.write('class Fine {\n}\n')
+            project = JavaProject(path)
+            failures = project.parse_all(workers=2)
+            self.assertEqual(len(failures), 1)
+            self.assertEqual(failures[0].path, 'Broken.java')
+            self.assertEqual(failures[0].error_type, 'ParseError')
+            self.assertIsNone(project._files['Broken.java'])
+            self.assertIsNotNone(project.get_file('Fine').get_class('Fine'))
+        finally:
+            shutil.rmtree(path)
+
+    def test_rescan_files(self):
+        path = tempfile.mkdtemp()
+        try:
+            def write(filename, content, mtime=None):
+                with open(os.path.join(path, filename), 'w') as f:
+                    f.write(content)
+                if mtime is not None:
+                    os.utime(os.path.join(path, filename), (mtime, mtime))
+
+            write('A.java', 'class A {\n}\n')
+            write('B.java', 'class B {\n}\n', mtime=1000)
+            write('C.java', 'class C {\n}\n')
+            project = JavaProject(path)
+            diff = project.rescan_files()
+            self.assertListEqual(diff.added, ['A.java', 'B.java', 'C.java'])
+            self.assertListEqual(diff.changed + diff.removed, [])
+            sf_a, sf_b = project.get_file('A'), project.get_file('B')
+
+            write('B.java', 'class B2 {\n}\n', mtime=2000)
+            os.remove(os.path.join(path, 'C.java'))
+            write('D.py', '')
+            diff = project.rescan_files()
+            self.assertListEqual(diff.added, ['D.py'])
+            self.assertListEqual(diff.changed, ['B.java'])
+            self.assertListEqual(diff.removed, ['C.java'])
+            self.assertItemsEqual(project.files.keys(), ['A.java', 'B.java', 'D.py'])
+            self.assertSetEqual(project.file_extensions, {'java', 'py'})
+
+            # unchanged files are not loaded again
+            self.assertIs(project.get_file('A'), sf_a)
+            self.assertIsNot(project.get_file('B'), sf_b)
+            self.assertIsNotNone(project.get_file('B').get_class('B2'))
+            self.assertEqual(project.rescan_files(), ([], [], []))
+        finally:
+            shutil.rmtree(path)
+
+    def test_qualified_paths(self):
+        path = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(path, 'app', 'java', 'com', 'g'))
+            with open(os.path.join(path, 'app', 'java', 'com', 'g', 'A.java'), 'w') as f:
+                f.write('package com.g;\n\nclass A {\n}\n')
+            project = JavaProject(path)
+            self.assertEqual(project.find_qualified_path('app.java.com.g.A'), 'app/java/com/g/A.java')
+            self.assertIsNone(project.find_qualified_path('com.g.A'))
+            self.assertRaises(KeyError, project.get_file, 'com.g.A')
+
+            # declared package of the parsed files
+            sf = project.get_file('app.java.com.g.A')
+            sf.ensure_parsed()
+            self.assertIs(project.get_file('com.g.A'), sf)
+
+            # source roots changes are applied
+            project.source_roots.insert(0, 'app/java')
+            self.assertEqual(project.find_qualified_path('com.g.A'), 'app/java/com/g/A.java')
+
+            os.remove(os.path.join(path, 'app', 'java', 'com', 'g', 'A.java'))
+            project.rescan_files()
+            self.assertIsNone(project.find_qualified_path('com.g.A'))
+            self.assertIsNone(project.find_qualified_path('app.java.com.g.A'))
+        finally:
+            shutil.rmtree(path)
+
+    def test_gitignore(self):
+        path = tempfile.mkdtemp()
+        try:
+            for d in ['.git/objects', 'bin', 'src/bin', 'src/a']:
+                os.makedirs(os.path.join(path, d))
+            for f in ['.gitignore', '.git/HEAD', '.git/objects/x', 'bin/A.class', 'src/bin/x', 'src/a/A.java',
+                      'src/a/A.class', 'src/a/B.java']:
+                with open(os.path.join(path, f), 'w') as fp:
+                    fp.write('*.class\n/bin/\n' if f == '.gitignore' else '')
+            project = JavaProject(path)
+            project.ignored_dirs.append('src/a/B')  # only directories are checked against ignored_dirs
+            self.assertItemsEqual(project.files.keys(), ['.gitignore', 'src/bin/x', 'src/a/A.java', 'src/a/B.java'])
+
+            # .git is ignored without a .gitignore too
+            os.remove(os.path.join(path, '.gitignore'))
+            self.assertItemsEqual(JavaProject(path).files.keys(),
+                                  ['bin/A.class', 'src/bin/x', 'src/a/A.java', 'src/a/A.class', 'src/a/B.java'])
+        finally:
+            shutil.rmtree(path)
+
+    def test_nested_symbols(self):
+        path = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(path, 'src', 'a'))
+            with open(os.path.join(path, 'src', 'a', 'Outer.java'), 'w') as f:
+                f.write('package a;\n'
+                        'public class Outer {\n'
+                        '    private int x;\n'
+                        '    class Inner {\n'
+                        '        void f() {\n'
+                        '            Runnable r = new Runnable() {\n'
+                        '                public void run() {\n'
+                        '                }\n'
+                        '            };\n'
+                        '        }\n'
+                        '    }\n'
+                        '    interface Listener {\n'
+                        '        void changed(int x);\n'
+                        '    }\n'
+                        '}\n')
+            project = JavaProject(path)
+            self.assertEqual(project.find('field:a.Outer.x').name, 'x')
+            inner = project.find('class:a.Outer.Inner')
+            self.assertEqual(inner.name, 'Inner')
+            self.assertListEqual(project.find('class:a.Outer').nested_classes,
+                                 [inner, project.find('interface:a.Outer.Listener')])
+            self.assertEqual(project.find('method:a.Outer.Inner.f').parent_class, inner)
+            self.assertEqual(project.find('method:a.Outer.Inner$1.run').name, 'run')
+            self.assertEqual(project.find('method:a.Outer.Listener.changed').name, 'changed')
+            symbol = project.symbols.get('class', 'a.Outer.Inner$1')
+            self.assertEqual((symbol.path, symbol.starting_line, symbol.ending_line), ('src/a/Outer.java', 6, 9))
+            self.assertRaises(KeyError, project.find, 'class:b.Outer')
+
+            # removed files are removed from the index
+            os.remove(os.path.join(path, 'src', 'a', 'Outer.java'))
+            project.rescan_files()
+            self.assertIsNone(project.symbols.get('class', 'a.Outer'))
+            self.assertEqual(len(project.symbols), 0)
+        finally:
+            shutil.rmtree(path)
+
+    def test_duplicate_symbols(self):
+        path = tempfile.mkdtemp()
+        try:
+            # both files define a.A, as the src source root is not a part of the names
+            for d in ['a', os.path.join('src', 'a')]:
+                os.makedirs(os.path.join(path, d))
+                with open(os.path.join(path, d, 'A.java'), 'w') as f:
+                    f.write('package a;\nclass A {\n    void f() {\n    }\n    void f(int x) {\n    }\n}\n')
+            project = JavaProject(path)
+            project.parse_all(workers=1)
+            first = project.symbols.get('class', 'a.A').path
+            self.assertItemsEqual([first, project.symbols._shadowed[('class', 'a.A')][0].path],
+                                  ['a/A.java', 'src/a/A.java'])
+
+            # the symbols of the other file are used after the first one is removed
+            os.remove(project.build_path(first))
+            project.rescan_files()
+            other = ({'a/A.java', 'src/a/A.java'} - {first}).pop()
+            self.assertEqual(project.symbols.get('class', 'a.A').path, other)
+            self.assertEqual(project.symbols.get('method', 'a.A.f').path, other)
+            os.remove(project.build_path(other))
+            project.rescan_files()
+            self.assertEqual(len(project.symbols), 0)
+            self.assertEqual(project.symbols._shadowed, {})
+        finally:
+            shutil.rmtree(path)
+
+    def test_mmap_threshold(self):
+        path = 'src/com/g/issue/IssueFragment.java'
+        self.assertFalse(self.project.get_file(path).use_mmap)
+
+        project = JavaProject(self.project.abs_path)
+        project.mmap_threshold = 1024
+        sf = project.get_file(path)
+        self.assertTrue(sf.use_mmap)
+        self.assertEqual(sf.get_class('IssueFragment').get_method('shareIssue').starting_line, 551)
+
+    def test_deferred_parsing(self):
+        path = 'src/com/g/issue/IssueFragment.java'
+        sf = self.project.get_file(path)
+        self.assertEqual(sf.lines_count, 604)
+        self.assertFalse(sf.parsed)
+        stats = self.project.parse_statistics()
+        self.assertEqual((stats.loaded, stats.parsed, stats.parse_time), (1, 0, 0))
+        self.assertIsNone(self.project.symbols.get('class', 'com.g.issue.IssueFragment'))
+
+        # models are parsed (and indexed) on first access
+        self.assertEqual(len(sf.classes), 1)
+        self.assertTrue(sf.parsed)
+        self.assertIsNotNone(self.project.symbols.get('class', 'com.g.issue.IssueFragment'))
+        stats = self.project.parse_statistics()
+        self.assertEqual((stats.files, stats.loaded, stats.parsed), (len(self.project.files), 1, 1))
+        self.assertGreater(stats.parse_time, 0)
+
+        self.project.get_file('src/com/g/issue/IssuesFragment.java').ensure_parsed()
+        self.assertEqual(self.project.parse_statistics().parsed, 2)
+
+    def test_concurrent_parsing(self):
+        sf1 = self.project.get_file('src/com/g/issue/IssueFragment.java')
+        sf2 = self.project.get_file('src/com/g/issue/IssuesFragment.java')
+        # files are locked separately, so a slow parse does not block the parse of other files
+        with base._get_parse_lock(sf1):
+            t = threading.Thread(target=sf2.ensure_parsed)
+            t.start()
+            t.join(10)
+            self.assertTrue(sf2.parsed)
+            self.assertFalse(sf1.parsed)
+        self.assertIsNotNone(self.project.symbols.get('class', 'com.g.issue.IssuesFragment'))
+
+    def test_export_tables(self):
+        tables = self.project.export_tables(workers=1)
+        self.assertEqual(len(tables.files), 2)
+        names = [tables.strings[i] for i in tables.classes['qualified_name']]
+        self.assertEqual(names[:2], ['com.g.issue.IssueFragment', 'com.g.issue.IssueFragment$1'])
+        self.assertItemsEqual(names, [s.qualified_name for s in self.project.symbols
+                                      if s.kind in ('class', 'interface')])
+
+        cls = self.project.find('class:com.g.issue.IssueFragment')
+        row = names.index(cls.qualified_name)
+        self.assertEqual(tables.classes['parent'][row], -1)
+        self.assertEqual(tables.classes['parent'][1], row)
+        self.assertEqual(tables.count_by(tables.methods, 'class', len(tables.classes))[row], len(cls.methods))
+
+        method = cls.get_method('shareIssue')
+        method_row = [tables.strings[i] for i in tables.methods['name']].index('shareIssue')
+        self.assertEqual(tables.methods['class'][method_row], row)
+        self.assertEqual(tables.lines_counts(tables.methods)[method_row],
+                         method.ending_line - method.starting_line + 1)
+        statements = [i for i, m in enumerate(tables.statements['method']) if m == method_row]
+        self.assertEqual(len(statements), len(method.statements))
+        st = tables.statements.row(statements[0])
+        self.assertEqual(cls.source_file.get_span(st['start'], st['end']), method.statements[0].code)
+
     def test_class_model(self):
         cls = self.project.find('class:com.g.issue.IssueFragment')
         self.assertEqual(cls.name, 'IssueFragment')
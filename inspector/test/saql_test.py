@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
+import time
+import socket
+import threading
 import unittest
 from inspector.saql.sams import SAMS
 from inspector.saql.saql_parser import SaqlParser
+from inspector.saql.protocol import BinaryDecoder, JsonLinesEncoder, read_json_response
+from inspector.saql.saqld import ReadWriteLock, SaqlServer
 
 
 class ParserTest(unittest.TestCase):
@@ -90,3 +95,248 @@ class SAMSTest(unittest.TestCase):
         q7 = "SELECT methods FROM project WHERE isPrivate()"
         r = self.sams.run_query(q7)
         self.assertEqual(len(r), 6+1)
+
+    def test_query_plan(self):
+        q1 = "EXPLAIN SELECT methods FROM project WHERE isPublic() AND nameIsLike('^on.*') AND nameIs('onCreate')"
+        self.assertEqual(SaqlParser.parse_query(q1).explain, True)
+        plan = self.sams.run_query(q1).split('\n')
+        self.assertEqual(plan[0], q1)
+        self.assertEqual(plan[1], "  1. index lookup: method_names['onCreate'] (2 of 29 methods)")
+        self.assertTrue(plan[2].startswith("  2. filter: nameIsLike('^on.*')"))
+        self.assertTrue(plan[3].startswith("  3. filter: isPublic()"))
+        r = self.sams.run_query(q1[len('EXPLAIN '):])
+        self.assertItemsEqual([m.qualified_name for m in r],
+                              ['com.g.issue.IssueFragment.onCreate', 'com.g.issue.IssuesFragment.onCreate'])
+
+        # the most selective index is used
+        q2 = "SELECT classes FROM project WHERE isSubclassOf('DialogFragment') AND nameIs('IssueFragment')"
+        plan = self.sams.run_query('EXPLAIN ' + q2).split('\n')
+        self.assertEqual(plan[1], "  1. index lookup: class_parents['DialogFragment'] (1 of 2 classes)")
+        self.assertEqual([c.name for c in self.sams.run_query(q2)], ['IssueFragment'])
+        self.assertListEqual(self.sams.run_query("SELECT classes FROM project WHERE nameIs('Other')"), [])
+
+        # not indexed sources are scanned
+        q3 = "EXPLAIN SELECT methods FROM class:com.g.issue.IssueFragment WHERE nameIs('shareIssue')"
+        self.assertEqual(self.sams.run_query(q3).split('\n')[1],
+                         '  1. scan: methods FROM class:com.g.issue.IssueFragment')
+        self.assertRaises(ValueError, self.sams.run_query, "SELECT methods FROM project WHERE isFinal()")
+
+    def test_index_consistency(self):
+        # index lookups give the same objects as evaluating the predicate on the scanned ones
+        classes = self.sams.run_query('SELECT classes FROM project')
+        for condition in ["nameIs('IssueFragment')", 'nameIs(class:com.g.issue.IssueFragment)',
+                          "isSubclassOf('DialogFragment')", 'isSubclassOf(class:com.g.issue.IssueFragment)']:
+            predicate = self.sams.planner.parse_predicate(condition, 'class')
+            self.assertListEqual(self.sams.run_query('SELECT classes FROM project WHERE ' + condition),
+                                 [c for c in classes if predicate(c)])
+        self.assertListEqual(self.sams.run_query('SELECT classes FROM project WHERE '
+                                                 'nameIs(class:com.g.issue.IssueFragment)'), [])
+
+    def test_indexes_invalidation(self):
+        indexes = self.sams.planner.project_indexes()
+        self.assertIs(self.sams.planner.project_indexes(), indexes)
+        self.sams.project.generation += 1
+        self.assertIsNot(self.sams.planner.project_indexes(), indexes)
+
+    def test_query_cache(self):
+        q = "SELECT methods FROM project WHERE nameIs('onCreate')"
+        plan = self.sams.compile_query(q)
+        r = self.sams.run_query(q)
+        self.assertIs(self.sams.compile_query(q), plan)
+        self.assertListEqual(self.sams.run_query(q), r)
+        self.assertEqual(self.sams.query_cache.hits, 3)
+        self.assertRaises(ValueError, self.sams.run_query, 'SELECT methods')
+        self.assertEqual(len(self.sams.query_cache), 1)
+
+        # plans are compiled again after the project files are changed
+        self.sams.project.generation += 1
+        self.assertIsNot(self.sams.compile_query(q), plan)
+
+    def test_limit(self):
+        q = SaqlParser.parse_query("SELECT methods FROM project WHERE nameIsLike('^on.*') LIMIT 10")
+        self.assertEqual(q.limit, 10)
+        self.assertListEqual(q.where_conditions, ["nameIsLike('^on.*')"])
+        self.assertEqual(unicode(q), "SELECT methods FROM project WHERE nameIsLike('^on.*') LIMIT 10")
+        self.assertIsNone(SaqlParser.parse_query('SELECT methods FROM project').limit)
+
+        # results are found lazily, so files are parsed only until the limit is reached
+        r = self.sams.iter_query("SELECT methods FROM project WHERE nameIsLike('^on.*') LIMIT 2")
+        self.assertEqual(self.sams.project.parse_statistics().parsed, 0)
+        self.assertEqual(len(list(r)), 2)
+        self.assertEqual(self.sams.project.parse_statistics().parsed, 1)
+        self.assertListEqual(self.sams.run_query("SELECT methods FROM project WHERE nameIsLike('^on.*') LIMIT 100"),
+                             self.sams.run_query("SELECT methods FROM project WHERE nameIsLike('^on.*')"))
+        self.assertListEqual(self.sams.run_query('SELECT methods FROM project LIMIT 0'), [])
+
+
+class ReadWriteLockTest(unittest.TestCase):
+    def test_writer_preference(self):
+        lock = ReadWriteLock()
+        events = []
+
+        def writer():
+            with lock.exclusive():
+                events.append('writer')
+
+        def reader():
+            with lock.shared():
+                events.append('reader')
+
+        with lock.shared():
+            w = threading.Thread(target=writer)
+            w.start()
+            time.sleep(0.1)  # the writer waits for the running reader
+            r = threading.Thread(target=reader)
+            r.start()
+            time.sleep(0.1)
+            self.assertListEqual(events, [])  # and the new reader waits for the writer
+        w.join()
+        r.join()
+        self.assertListEqual(events, ['writer', 'reader'])
+
+
+class SaqlServerTest(unittest.TestCase):
+    def setUp(self):
+        path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data', 'projects', 'gissue')
+        sams = SAMS()
+        sams.open_project(path)
+        self.server = SaqlServer(('127.0.0.1', 0), sams)
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown_gracefully(timeout=2)
+        self.thread.join()
+
+    def connect(self):
+        conn = socket.create_connection(self.server.server_address)
+        return conn, conn.makefile('r')
+
+    @staticmethod
+    def read_response(f):
+        lines = []
+        for line in iter(f.readline, '\n'):
+            lines.append(line.rstrip('\n'))
+        return lines
+
+    def test_clients(self):
+        conn1, f1 = self.connect()
+        conn2, f2 = self.connect()
+        # requests are framed by newlines, so they can be sent together, or in parts
+        conn1.sendall("SELECT classes FROM project WHERE nameIs('IssueFragment')\nSELECT x\nSELECT classes ")
+        conn2.sendall('SELECT methods FROM class:com.g.issue.IssueFragment LIMIT 2\n')
+        self.assertListEqual(self.read_response(f2), ['method:com.g.issue.IssueFragment.onCreate',
+                                                      'method:com.g.issue.IssueFragment.onActivityCreated'])
+        self.assertListEqual(self.read_response(f1), ['class:com.g.issue.IssueFragment'])
+        self.assertListEqual(self.read_response(f1), ['ERROR: Invalid Query!'])
+        conn1.sendall("FROM project WHERE nameIs('IssuesFragment')\n\\q\n")
+        self.assertListEqual(self.read_response(f1), ['class:com.g.issue.IssuesFragment'])
+        self.assertEqual(f1.readline(), '')  # closed by \\q
+        conn2.sendall('\\r\n')
+        self.assertListEqual(self.read_response(f2), ['Project rescanned: 0 added, 0 changed, 0 removed'])
+        for c in [conn1, conn2]:
+            c.close()
+
+    def test_formats(self):
+        conn, f = self.connect()
+        query = "SELECT methods FROM class:com.g.issue.IssueFragment WHERE nameIsLike('^on.*') LIMIT 2\n"
+        expected = [
+            {'kind': 'method', 'name': 'com.g.issue.IssueFragment.onCreate',
+             'file': 'src/com/g/issue/IssueFragment.java', 'start_line': 169, 'end_line': 224},
+            {'kind': 'method', 'name': 'com.g.issue.IssueFragment.onActivityCreated',
+             'file': 'src/com/g/issue/IssueFragment.java', 'start_line': 226, 'end_line': 249},
+        ]
+        conn.sendall('\\f json\n' + query + 'SELECT x\n')
+        self.assertListEqual(list(read_json_response(f)), [{'kind': 'text', 'text': 'Format: json'}])
+        self.assertListEqual(list(read_json_response(f)), expected)
+        self.assertRaisesRegexp(ValueError, 'Invalid Query', list, read_json_response(f))
+
+        conn.sendall('\\f binary\n' + query + '\\f xml\n')
+        decoder = BinaryDecoder(f)
+        self.assertListEqual(list(decoder.read_response()), [{'kind': 'text', 'text': 'Format: binary'}])
+        self.assertListEqual(list(decoder.read_response()), expected)
+        self.assertRaisesRegexp(ValueError, 'Invalid format: xml', list, decoder.read_response())
+
+        conn.sendall('\\f text\n' + query)
+        self.assertListEqual(self.read_response(f), ['Format: text'])
+        self.assertListEqual(self.read_response(f), ['method:' + r['name'] for r in expected])
+        conn.close()
+
+    def slow_command(self):
+        """ Make the 'SLOW' command return a result, and then wait for the returned event to return another one
+        """
+        release = threading.Event()
+        sams = self.server.sams
+        stream = sams.stream
+
+        def slow_results():
+            yield u'started'
+            release.wait(5)
+            yield u'done'
+        sams.stream = lambda command: slow_results() if command == 'SLOW' else stream(command)
+        return release
+
+    def test_concurrent_queries(self):
+        release = self.slow_command()
+        conn1, f1 = self.connect()
+        conn2, f2 = self.connect()
+        conn1.sendall('SLOW\n')
+        self.assertEqual(f1.readline(), 'started\n')  # sent before the query is finished
+        # other queries are not blocked by the running one
+        conn2.sendall("SELECT classes FROM project WHERE nameIs('IssueFragment')\n")
+        self.assertListEqual(self.read_response(f2), ['class:com.g.issue.IssueFragment'])
+        release.set()
+        self.assertListEqual(self.read_response(f1), ['done'])
+        for c in [conn1, conn2]:
+            c.close()
+
+    def test_graceful_shutdown(self):
+        release = self.slow_command()
+        conn1, f1 = self.connect()
+        conn2, f2 = self.connect()  # idle
+        conn1.sendall('SLOW\n')
+        self.assertEqual(f1.readline(), 'started\n')
+        self.assertEqual(self.server.connections_count, 2)
+
+        shutdown = threading.Thread(target=self.server.shutdown_gracefully, kwargs={'timeout': 5})
+        shutdown.start()
+        time.sleep(0.1)
+        self.assertTrue(shutdown.is_alive())  # waiting for the running query
+        release.set()
+        shutdown.join(5)
+        self.assertFalse(shutdown.is_alive())
+        self.assertEqual(self.server.connections_count, 0)
+        # the running query is finished, and then both connections are closed
+        self.assertListEqual(self.read_response(f1), ['done'])
+        self.assertEqual(f1.readline(), '')
+        self.assertEqual(f2.readline(), '')
+        self.assertRaises(socket.error, socket.create_connection, self.server.server_address, 1)
+        for c in [conn1, conn2]:
+            c.close()
+
+    def test_unexpected_errors(self):
+        conn, f = self.connect()
+        conn.sendall('\\s /nonexistent/dir/snapshot\nSELECT classes FROM project WHERE nameIs(\'IssueFragment\')\n')
+        error = self.read_response(f)
+        self.assertEqual(len(error), 1)
+        self.assertRegexpMatches(error[0], r'^ERROR: IOError: .*nonexistent')
+        # the connection is still usable
+        self.assertListEqual(self.read_response(f), ['class:com.g.issue.IssueFragment'])
+        conn.close()
+
+    def test_chunks(self):
+        chunks = list(JsonLinesEncoder().encode_response(iter(range(5)), chunk_size=2))
+        self.assertListEqual([c.count('\n') for c in chunks], [2, 2, 1, 1])  # the last one is the end
+        self.assertEqual(chunks[-1], '{"count":5,"end":true}\n')
+
+    def test_flush_interval(self):
+        def slow_results():
+            yield u'first'
+            time.sleep(1)  # e.g. scanning many files without finding any results
+            yield u'second'
+
+        start_time = time.time()
+        chunks = JsonLinesEncoder().encode_response(slow_results(), flush_interval=0.05)
+        self.assertEqual(next(chunks), '{"kind":"text","text":"first"}\n')
+        self.assertLess(time.time() - start_time, 0.5)  # not waiting for the next result
+        self.assertListEqual(list(chunks), ['{"kind":"text","text":"second"}\n', '{"count":2,"end":true}\n'])
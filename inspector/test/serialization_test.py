@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import os
+import mmap
+import shutil
+import tempfile
+import unittest
+
+from inspector.models import serialization
+from inspector.models.base import Statement
+from inspector.models.java import JavaProject
+from inspector.models.serialization import ModelReader, ModelWriter, SerializationError, dumps, loads
+
+
+class SerializationTest(unittest.TestCase):
+    def test_values(self):
+        values = [None, True, False, 0, 1, -1, 63, 64, -300, 2 ** 70, -2 ** 70, 1.5, '', 'abc', u'سلام',
+                  (1, 'a'), [1, [2, 3]], {'a': 1, u'b': [None]}]
+        restored = loads(dumps(values))
+        self.assertEqual(restored, values)
+        self.assertIs(type(restored[13]), str)
+        self.assertIs(type(restored[14]), unicode)
+        self.assertIs(type(restored[15]), tuple)
+
+        for n in [0, 1, 127, 128, 2 ** 35]:
+            buf = bytearray()
+            serialization.write_varint(buf, n)
+            self.assertEqual(serialization.read_varint(buf, 0), (n, len(buf)))
+            self.assertEqual(serialization.unzigzag(serialization.zigzag(-n)), -n)
+
+    def test_shared_references(self):
+        shared = [1]
+        st = Statement('int x = 1;')
+        restored = loads(dumps([shared, shared, st, st]))
+        self.assertIs(restored[0], restored[1])
+        self.assertIs(restored[2], restored[3])
+        self.assertEqual(restored[2].code, 'int x = 1;')
+
+        cyclic = []
+        cyclic.append(cyclic)
+        restored = loads(dumps(cyclic))
+        self.assertIs(restored[0], restored)
+
+    def test_invalid_data(self):
+        self.assertRaises(SerializationError, loads, '')
+        self.assertRaises(SerializationError, loads, 'not a model file')
+        data = dumps('abc')
+        self.assertRaises(SerializationError, loads, data[:-3])
+        self.assertRaises(SerializationError, loads, data.replace('SIMF\x01', 'SIMF\x09', 1))
+        self.assertRaises(SerializationError, dumps, object())
+        self.assertRaises(SerializationError, loads, dumps(Statement('x;')).replace('inspector.', 'xnspector.'))
+
+
+class ModelFileTest(unittest.TestCase):
+    def setUp(self):
+        path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data', 'projects', 'gissue')
+        self.project = JavaProject(path)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_source_file(self):
+        path = 'src/com/g/issue/IssueFragment.java'
+        sf = self.project.get_file(path)
+        sf.ensure_parsed()
+        restored = loads(dumps(sf))
+        self.assertTrue(restored.parsed)
+        self.assertEqual(restored.project_path, path)
+        self.assertEqual(unicode(restored), unicode(sf))
+        self.assertEqual(len(restored.imports), len(sf.imports))
+
+        cls = restored.get_class('IssueFragment')
+        self.assertEqual(cls.qualified_name, 'com.g.issue.IssueFragment')
+        method = cls.get_method('shareIssue')
+        self.assertIs(method.parent_class, cls)
+        self.assertIs(method.source_file, restored)
+        self.assertEqual(method.starting_line, 551)
+        original = sf.get_class('IssueFragment')
+        self.assertListEqual([unicode(m) for m in cls.methods], [unicode(m) for m in original.methods])
+        # statements are saved by their offsets, the code is read from the file again
+        self.assertEqual(method.statements[0].code, original.get_method('shareIssue').statements[0].code)
+
+    def test_random_access(self):
+        filename = os.path.join(self.path, 'models.simf')
+        self.project.parse_all(workers=1)
+        with open(filename, 'wb') as f:
+            with ModelWriter(f) as writer:
+                for path in sorted(self.project.files):
+                    writer.write(path, self.project.files[path])
+                writer.write('paths', sorted(self.project.files))
+
+        with open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            reader = ModelReader(data)
+            self.assertEqual(len(reader), 3)
+            self.assertEqual(reader.parser_version, serialization.PARSER_VERSION)
+            self.assertItemsEqual(reader.read('paths'), self.project.files.keys())
+            sf = reader.read('src/com/g/issue/IssuesFragment.java')
+            self.assertEqual(sf.get_class('IssuesFragment').name, 'IssuesFragment')
+            self.assertNotIn('src/com/g/issue/Other.java', reader)
+            self.assertRaises(KeyError, reader.read, 'src/com/g/issue/Other.java')
+        finally:
+            data.close()
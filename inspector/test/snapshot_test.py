@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from inspector.models import snapshot
+from inspector.models.consts import ParseMode
+from inspector.models.java import JavaProject
+from inspector.saql.sams import SAMS
+from inspector.test.cache_test import CountingJavaProject
+
+
+class ProjectSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.project_path = os.path.join(self.path, 'project')
+        src = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data', 'projects', 'gissue')
+        shutil.copytree(src, self.project_path)
+        self.snapshot_path = os.path.join(self.path, 'gissue.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_open_snapshot(self):
+        self.assertListEqual(CountingJavaProject(self.project_path).save_snapshot(self.snapshot_path), [])
+
+        project = CountingJavaProject(self.project_path)
+        self.assertTrue(project.open_snapshot(self.snapshot_path))
+        cls = project.find('class:com.g.issue.IssueFragment')
+        self.assertEqual(cls.get_method('shareIssue').starting_line, 551)
+        self.assertEqual(project.find('method:com.g.issue.IssueFragment$1.onSuccess').name, 'onSuccess')
+        self.assertIsNotNone(project.find('class:com.g.issue.IssuesFragment'))
+        self.assertListEqual(project.loaded_files, [])  # no file is parsed
+
+        # changed files are parsed again
+        path = os.path.join(self.project_path, 'src', 'com', 'g', 'issue', 'IssuesFragment.java')
+        with open(path, 'a') as f:
+            f.write('\n')
+        project.rescan_files()
+        self.assertIsNotNone(project.find('class:com.g.issue.IssuesFragment'))
+        self.assertListEqual(project.loaded_files, ['src/com/g/issue/IssuesFragment.java'])
+        project.close_snapshot()
+
+    def test_outdated_snapshot(self):
+        JavaProject(self.project_path).save_snapshot(self.snapshot_path)
+        project = JavaProject(self.project_path)
+        project.parse_mode = ParseMode.HEADERS
+        self.assertFalse(project.open_snapshot(self.snapshot_path))
+
+        old_version = snapshot.PARSER_VERSION
+        snapshot.PARSER_VERSION += 1
+        try:
+            self.assertFalse(JavaProject(self.project_path).open_snapshot(self.snapshot_path))
+        finally:
+            snapshot.PARSER_VERSION = old_version
+
+    def test_sams_snapshot(self):
+        sams = SAMS()
+        sams.open_project(self.project_path, snapshot_path=self.snapshot_path)
+        self.assertTrue(os.path.exists(self.snapshot_path))
+
+        # blanking the sources (keeping their size and mtime), so the results can only come from the snapshot
+        for path in sams.project.filter_files(extension='java'):
+            path = sams.project.build_path(path)
+            st = os.stat(path)
+            with open(path, 'w') as f:
+                f.write(' ' * st.st_size)
+            os.utime(path, (st.st_atime, st.st_mtime))
+
+        sams.open_project(self.project_path, snapshot_path=self.snapshot_path)
+        self.assertIsNotNone(sams.project.snapshot)
+        r = sams.run_query("SELECT methods FROM project WHERE nameIs('onCreate')")
+        self.assertItemsEqual([m.qualified_name for m in r],
+                              ['com.g.issue.IssueFragment.onCreate', 'com.g.issue.IssuesFragment.onCreate'])
+
+        # restored float mtimes may be off by a microsecond
+        rel_path = 'src/com/g/issue/IssueFragment.java'
+        mtime, size = sams.project.snapshot.files_stat[rel_path]
+        self.assertIsNotNone(sams.project.snapshot.get_file(rel_path, (mtime + 1e-6, size)))
+        self.assertIsNone(sams.project.snapshot.get_file(rel_path, (mtime + 1, size)))
+        self.assertIsNone(sams.project.snapshot.get_file(rel_path, (mtime, size + 1)))
+        sams.project.close_snapshot()
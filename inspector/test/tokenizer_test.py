@@ -2,7 +2,8 @@
 from tempfile import TemporaryFile
 import unittest
 
-from inspector.parser.file_tokenizer import FileTokenizer
+from inspector.models.java import IsNotBreaking
+from inspector.parser.file_tokenizer import FileTokenizer, StopAt
 
 
 class TestFileTokenizer(unittest.TestCase):
@@ -55,3 +56,36 @@ class TestFileTokenizer(unittest.TestCase):
     def test_argument_checking(self):
         tz = FileTokenizer(content_file=self.SAMPLE_STRING_1)
         self.assertRaises(ValueError, tz.next_char, skip=-2)
+
+    def test_scan_read(self):
+        tz = FileTokenizer(content_file=self.SAMPLE_STRING_1)
+        self.assertEqual(tz.read(until='\n'), 'abc')
+        self.assertEqual(tz.current_line(), 1)
+        self.assertEqual(tz.read(until='2'), '\nabc1\n\n')
+        self.assertEqual(tz.current_line(), 4)
+        self.assertEqual(tz.read(cond=StopAt('-'), beyond=1), '2\ng-')
+        self.assertEqual(tz.current_line(), 5)
+        self.assertEqual(tz.read(until='?'), 'h-i-j-k-lm.')
+        self.assertFalse(tz.can_read())
+        self.assertEqual(tz.read(until='?'), '')
+
+    def test_scan_condition_equivalence(self):
+        content = 'for (int i = 0; i < f(a, b); i++) { x(); }'
+        tz1 = FileTokenizer(content_file=content)
+        tz2 = FileTokenizer(content_file=content)
+        slow = IsNotBreaking()
+        self.assertEqual(tz1.read(cond=IsNotBreaking()), tz2.read(cond=lambda ch: slow(ch)))
+        self.assertEqual(tz1.current_head(), 34)
+        self.assertEqual(tz2.current_head(), 34)
+
+    def test_line_tracking(self):
+        tz = FileTokenizer(content_file=self.SAMPLE_STRING_1)
+        self.assertEqual(tz.next_char(skip=9), '\n')
+        self.assertEqual(tz.current_line(), 4)
+        self.assertEqual(tz.read(until='g'), '2\n')
+        self.assertEqual(tz.current_line(), 5)
+        tz.rewind_to(4)
+        self.assertEqual(tz.current_line(), 2)
+        self.assertEqual(tz.next_char(skip=100), None)
+        self.assertEqual(tz.current_line(), 5)
+        self.assertFalse(tz.can_read())
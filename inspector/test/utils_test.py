@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 import unittest
+from StringIO import StringIO
+
+from inspector.utils.files import GitIgnore
+from inspector.utils.lang import LRUCache
+from inspector.utils.lines import LineIndex, LinesView
 from inspector.utils.strings import has_word, quoted, summarize, render_template
 
 
@@ -40,3 +45,67 @@ class StringsTest(unittest.TestCase):
         params = {'name': 'Bob', 'sender': 'John Smith'}
         rendered = 'Hi Bob,\nI like to say hello to you (Bob), that\'s it.\nBests,\nJohn Smith'
         self.assertEqual(render_template(template, params), rendered)
+
+
+class LinesTest(unittest.TestCase):
+    def test_line_index(self):
+        index = LineIndex('ab\ncd\n\ne')
+        self.assertEqual(list(index.offsets), [2, 5, 6])
+        self.assertEqual(index.line_at(0), 1)
+        self.assertEqual(index.line_at(2), 1)
+        self.assertEqual(index.line_at(3), 2)
+        self.assertEqual(index.line_at(7), 4)
+
+    def test_lines_view(self):
+        for content in ['', 'a', 'a\n', '\n\n', 'ab\ncd\n\ne', 'ab\r\ncd\r\n']:
+            lines = StringIO(content).readlines()
+            view = LinesView(content)
+            self.assertEqual(len(view), len(lines))
+            self.assertListEqual(list(view), lines)
+            self.assertListEqual(view[1:], lines[1:])
+            if lines:
+                self.assertEqual(view[-1], lines[-1])
+        self.assertRaises(IndexError, LinesView('a\nb').__getitem__, 2)
+
+
+class FilesTest(unittest.TestCase):
+    def test_gitignore(self):
+        gi = GitIgnore(['# comment\n', '\n', '*.py[co]\n', 'bin/\n', '/build\n', 'docs/**/*.tmp\n', '!keep.pyc\n'])
+        self.assertTrue(gi.match('a.pyc'))
+        self.assertTrue(gi.match('a/b/c.pyo'))
+        self.assertFalse(gi.match('a.py'))
+        self.assertFalse(gi.match('a/keep.pyc'))
+        self.assertTrue(gi.match('bin', is_dir=True))
+        self.assertTrue(gi.match('a/bin', is_dir=True))
+        self.assertFalse(gi.match('a/bin'))
+        self.assertTrue(gi.match('build', is_dir=True))
+        self.assertFalse(gi.match('a/build', is_dir=True))
+        self.assertTrue(gi.match('docs/x.tmp'))
+        self.assertTrue(gi.match('docs/a/b/x.tmp'))
+        self.assertFalse(gi.match('a/docs/x.tmp'))
+
+        # negated and literal ^ bracket expressions
+        gi = GitIgnore(['*.[!o]\n', 'x[^a]\n'])
+        self.assertTrue(gi.match('a.c'))
+        self.assertFalse(gi.match('a.o'))
+        self.assertTrue(gi.match('a.!'))
+        self.assertTrue(gi.match('x^'))
+        self.assertTrue(gi.match('xa'))
+        self.assertFalse(gi.match('xb'))
+
+
+class LangTest(unittest.TestCase):
+    def test_lru_cache(self):
+        cache = LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.put('a', 4)
+        cache.put('d', 5)
+        self.assertEqual(cache.get('a'), 4)
+        self.assertNotIn('c', cache)
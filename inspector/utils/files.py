@@ -1,6 +1,163 @@
 # -*- coding: utf-8 -*-
 import os
+import re
+import stat
+
+from inspector.utils.lang import enum
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # backport for python 2
+    except ImportError:
+        scandir = None
 
 
 def get_extension(filename):
     return os.path.splitext(filename)[1][1:].lower()
+
+
+def same_stat(stat1, stat2, mtime_tolerance=0.001):
+    """ Determine if the (mtime, size) stats are of the same file content
+         note: float mtimes are compared with a tolerance, as some systems (e.g. os.utime) do not restore
+               them exactly
+    """
+    return stat1[1] == stat2[1] and abs(stat1[0] - stat2[0]) <= mtime_tolerance
+
+
+WalkEvent = enum('ENTER_DIR', 'FILE', 'EXIT_DIR')
+
+
+def _list_dir(path):
+    """ Return (name, is_dir, stat) of the entries of a directory, stat is None for dirs
+         note: like os.walk, links to directories are reported as directories
+    """
+    entries = []
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                if entry.is_dir():
+                    entries.append((entry.name, not entry.is_symlink(), None))
+                else:
+                    entries.append((entry.name, False, entry.stat()))
+            except OSError:
+                continue  # removed while scanning, or a broken link
+    else:
+        for name in os.listdir(path):
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                entries.append((name, not os.path.islink(os.path.join(path, name)), None))
+            else:
+                entries.append((name, False, st))
+    return entries
+
+
+def walk_tree(root, is_ignored=None, rel_path=''):
+    """ Walk a directory tree depth-first, not descending into the ignored directories
+         yields (event, relative path, stat) tuples, stat is only given for FILE events
+         note: files of a directory come before its sub directories, like in os.walk
+         note: links to directories are neither entered nor reported as files, like in os.walk
+
+        :param str root: the directory to walk
+        :param is_ignored: is_ignored(relative path, is_dir) determines which entries are skipped
+    """
+    if is_ignored is not None and not rel_path and is_ignored(rel_path, True):
+        return
+    yield WalkEvent.ENTER_DIR, rel_path, None
+    dirs = []
+    for name, walkable, st in _list_dir(os.path.join(root, rel_path)):
+        path = rel_path + '/' + name if rel_path else name
+        is_dir = st is None
+        if is_ignored is not None and is_ignored(path, is_dir):
+            continue
+        if not is_dir:
+            yield WalkEvent.FILE, path, st
+        elif walkable:
+            dirs.append(path)
+    for path in dirs:
+        for event in walk_tree(root, is_ignored, rel_path=path):
+            yield event
+    yield WalkEvent.EXIT_DIR, rel_path, None
+
+
+class GitIgnore(object):
+    """ Compiled .gitignore patterns, matching paths relative to the .gitignore directory
+         note: nested .gitignore files are not supported
+    """
+
+    def __init__(self, lines):
+        self.patterns = []  # (regex, negated, dir_only)
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            line = line.rstrip(' ')
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line  # patterns containing a / are relative to the .gitignore directory
+            line = line.lstrip('/')
+            regex = self.translate(line)
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            self.patterns.append((re.compile(regex + r'\Z'), negated, dir_only))
+
+    @staticmethod
+    def translate(pattern):
+        """ Convert a glob pattern to a regex, * and ? do not match / but ** does
+        """
+        res = ''
+        i, n = 0, len(pattern)
+        while i < n:
+            c = pattern[i]
+            if pattern.startswith('**/', i):
+                res += '(?:.*/)?'
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                res += '.*'
+                i += 2
+                continue
+            if c == '*':
+                res += '[^/]*'
+            elif c == '?':
+                res += '[^/]'
+            elif c == '[' and ']' in pattern[i + 1:]:
+                j = pattern.index(']', i + 1)
+                chars = pattern[i + 1:j].replace('\\', '\\\\')
+                if chars.startswith('!'):
+                    chars = '^/' + chars[1:]  # negated, like fnmatch (but never matching a /)
+                elif chars.startswith('^'):
+                    chars = '\\' + chars
+                res += '[' + chars + ']'
+                i = j
+            else:
+                res += re.escape(c)
+            i += 1
+        return res
+
+    @classmethod
+    def from_file(cls, filename, extra_lines=()):
+        """
+            :param list extra_lines: patterns added before the patterns of the file, e.g. ['/.git/']
+        """
+        with open(filename, 'r') as f:
+            return cls(list(extra_lines) + f.readlines())
+
+    def match(self, path, is_dir=False):
+        """ Determine if the relative path is ignored, the last matching pattern decides
+             note: the contents of an ignored directory are not checked, as they are not walked
+        """
+        ignored = False
+        for regex, negated, dir_only in self.patterns:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                ignored = not negated
+        return ignored
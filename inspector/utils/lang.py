@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
 
 
 def enum(*sequential, **named):
@@ -11,3 +13,46 @@ def enum(*sequential, **named):
     enums['reverse'] = reverse
     enums['display_name'] = display
     return type('Enum', (), enums)
+
+
+class LRUCache(object):
+    """ A mapping of at most max_size items, the least recently used ones are dropped first, safe to be shared
+         by threads
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """ Return the value of the key (marking it as recently used), or default if it is not in the cache
+        """
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import re
+from array import array
+from bisect import bisect_left
+
+
+NEWLINE_RE = re.compile(r'\n')
+
+
+class LineIndex(object):
+    """ Offsets of all newlines of a content, mapping any content position to its line number
+    """
+
+    def __init__(self, content):
+        """
+            :param str content: the indexed content, any buffer supporting re is accepted
+        """
+        self.offsets = array('I', [m.start() for m in NEWLINE_RE.finditer(content)])
+
+    def line_at(self, position):
+        """ Return the (1-based) line number the char at the given position is in
+        """
+        return bisect_left(self.offsets, position) + 1
+
+    @property
+    def newlines_count(self):
+        return len(self.offsets)
+
+
+class LinesView(object):
+    """ Read-only list-like view of the lines of a content, with the same items as readlines()
+         lines are sliced from the shared content when accessed, and not stored
+    """
+
+    def __init__(self, content, line_index=None):
+        """
+            :param str content: the content to be viewed
+            :param LineIndex line_index: index of the content, built if not given
+        """
+        self.content = content
+        self.line_index = line_index or LineIndex(content)
+        self._count = self.line_index.newlines_count
+        if len(content) and content[-1] != '\n':
+            self._count += 1  # the last line has no \n
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in xrange(*item.indices(self._count))]
+        if item < 0:
+            item += self._count
+        if not 0 <= item < self._count:
+            raise IndexError('line index out of range')
+        offsets = self.line_index.offsets
+        start = offsets[item - 1] + 1 if item > 0 else 0
+        end = offsets[item] + 1 if item < len(offsets) else len(self.content)
+        return self.content[start:end]
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self[i]
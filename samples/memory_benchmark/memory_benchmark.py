@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+import gc
+import sys
+import logging
+import resource
+from collections import defaultdict
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..'))
+from inspector.models.base import CodeBlock, Comment, Field, Import, Statement
+from inspector.models.java import JavaSourceFile
+from inspector.parser.base import Token
+
+
+DATA_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', 'inspector', 'test', 'data')
+MODEL_TYPES = (Token, Statement, Comment, Field, Import, CodeBlock)
+
+
+def java_files(path):
+    for dir_path, dir_names, filenames in os.walk(path):
+        for f in filenames:
+            if f.endswith('.java'):
+                yield os.path.join(dir_path, f)
+
+
+def object_size(obj):
+    """ Size of the object, including its __dict__ and the strings it holds (e.g. code of a statement)
+    """
+    size = sys.getsizeof(obj)
+    values = []
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+        values.extend(obj.__dict__.itervalues())
+    for cls in type(obj).__mro__:
+        values.extend(getattr(obj, name, None) for name in getattr(cls, '__slots__', ()))
+    return size + sum(sys.getsizeof(v) for v in values if isinstance(v, basestring))
+
+
+if __name__ == '__main__':
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    keep_content = '--keep-content' in sys.argv  # e.g. for analyzing the code after parsing
+    logging.disable(logging.CRITICAL)
+
+    filenames = list(java_files(DATA_PATH))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    source_files = []
+    for _ in range(copies):
+        for filename in filenames:
+            sf = JavaSourceFile(filename)
+            sf.ensure_parsed()
+            if not keep_content:
+                sf.unload_content()
+            source_files.append(sf)
+    gc.collect()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    counts, sizes = defaultdict(int), defaultdict(int)
+    for obj in gc.get_objects():
+        if isinstance(obj, MODEL_TYPES):
+            name = type(obj).__name__
+            counts[name] += 1
+            sizes[name] += object_size(obj)
+
+    print('{0} files, {1} copies'.format(len(filenames), copies))
+    for name in sorted(sizes, key=sizes.get, reverse=True):
+        print('{0:>24}: {1:>8} objects, {2:>8.1f}KB'.format(name, counts[name], sizes[name] / 1024.))
+    print('{0:>24}: {1:>8} objects, {2:>8.1f}KB'.format('total', sum(counts.values()), sum(sizes.values()) / 1024.))
+    print('max RSS growth: {0:.1f}MB'.format((rss_after - rss_before) / 1024.))
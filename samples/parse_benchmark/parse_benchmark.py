@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import logging
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..'))
+from inspector.models.java import JavaSourceFile
+
+
+DATA_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', 'inspector', 'test', 'data',
+                         'android', 'github-android', 'sample_files')
+
+
+if __name__ == '__main__':
+    passes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    logging.disable(logging.CRITICAL)  # logging cost would hide the parsing cost
+
+    filenames = [os.path.join(DATA_PATH, f) for f in os.listdir(DATA_PATH) if f.endswith('.java')]
+    start_time = time.time()
+    for _ in range(passes):
+        for filename in filenames:
+            JavaSourceFile(filename).ensure_parsed()
+    d = time.time() - start_time
+
+    print('{0} files, {1} passes'.format(len(filenames), passes))
+    print('{0:.1f}ms per pass'.format(d * 1000 / passes))